@@ -0,0 +1,55 @@
+"""
+Check of the sigma clipped background reduction. Clean scans with constant Gaussian noise and with shot noise of a
+spectrum with a few bright pixels should be rejected at about the nominal rate of the clip level (0.27 % at 3 sigma)
+and give the noise of the scans, also for the bright pixels. A cosmic ray in one scan has to be rejected.
+"""
+from pathlib import Path
+import sys
+import math
+import numpy as np
+path_root = Path(__file__).parents[2]
+sys.path.append(str(Path(path_root, 'src')))
+from DataHandling.BackgroundReduction import reduce_scans
+
+speclength = 2048
+clip_sigma = 3.
+repeats = 20
+rng = np.random.default_rng(0)
+
+
+def gaussian_scans(scans):
+    level = np.full(speclength, 1000.)
+    return rng.normal(level, 10., (scans, speclength)), np.full(speclength, 10.)
+
+
+def shot_noise_scans(scans):
+    level = np.full(speclength, 100.)
+    bright = rng.choice(speclength, 248, replace=False)
+    level[bright] = rng.uniform(100., 50000., len(bright))
+    return rng.poisson(level, (scans, speclength)).astype(np.float64), np.sqrt(level)
+
+
+print(f'nominal rejection at {clip_sigma:.0f} sigma: {100 * math.erfc(clip_sigma / math.sqrt(2)):.2f} %')
+for scans in (5, 20):
+    for name, scan_function in [('gaussian', gaussian_scans), ('shot noise', shot_noise_scans)]:
+        rejected = 0
+        noise_ratio = []
+        bright_ratio = []
+        for i in range(repeats):
+            block, sigma = scan_function(scans)
+            background, noise, n_rejected = reduce_scans(block, 'sigma_clip', clip_sigma)
+            rejected = rejected + n_rejected
+            noise_ratio.append(np.median(noise / sigma))
+            bright = sigma > 3 * np.median(sigma)
+            bright_ratio.append(np.median(noise[bright] / sigma[bright]) if np.any(bright) else np.nan)
+        # the median of the standard deviation of few scans is below sigma also without clipping
+        expected = np.median(np.std(rng.normal(0., 1., (scans, 100000)), axis=0, ddof=1))
+        bright_text = f', bright pixels {np.mean(bright_ratio):.3f} sigma' if not np.all(np.isnan(bright_ratio)) else ''
+        print(f'{name:>10}, {scans:2d} scans: {100 * rejected / (repeats * scans * speclength):.2f} % rejected, '
+              f'noise {np.mean(noise_ratio):.3f} sigma{bright_text} (unclipped {expected:.3f})')
+
+block, sigma = shot_noise_scans(5)
+block[2, 1000] = block[2, 1000] + 2000.
+background, noise, n_rejected = reduce_scans(block, 'sigma_clip', clip_sigma)
+clipped = np.abs(background[1000] - np.median(block[:, 1000])) < 3 * sigma[1000]
+print(f'cosmic ray of 2000 counts: {"rejected" if clipped else "NOT rejected"}, {n_rejected} values rejected in total')
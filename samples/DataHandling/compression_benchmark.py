@@ -0,0 +1,51 @@
+"""
+Benchmark of the compression presets of the spectra dataset. Spectra are taken from the demo workers of the
+spectrometer and of the Stresing camera and written with SpectraWriter in their native type as during a measurement.
+Reports the writing speed in MB/s of raw data and the compression ratio, such that the preset can be chosen per
+experiment with DataHandling.set_compression().
+"""
+from pathlib import Path
+import sys
+import os
+import time
+import tempfile
+import numpy as np
+path_root = Path(__file__).parents[2]
+sys.path.append(str(Path(path_root, 'src')))
+from DataHandling.SpectraWriter import SpectraWriter, COMPRESSION_PRESETS
+from drivers.SpectrometerDemo_advanced import SpectrometerWorker
+from drivers.StresingDemo import StresingWorker
+
+n_parameter = 12
+flush_size = 100
+n_buffers = 50
+n_acquired = 100  # spectra taken from the worker, repeated to fill all buffers
+
+
+def acquire(worker, int_time):
+    worker.int_time = int_time
+    return np.array([worker.getIntensities() for i in range(n_acquired)])
+
+
+def benchmark(name, spectra):
+    rows = {'parameters': np.zeros([flush_size * n_buffers, n_parameter]) + np.random.rand(n_parameter),
+            'spectra': np.resize(spectra, (flush_size * n_buffers, spectra.shape[1]))}
+    layout = {key: (rows[key].shape[1], rows[key].dtype) for key in rows}
+    n_bytes = sum(rows[key].nbytes for key in rows)
+    print(f'{name}: {flush_size * n_buffers} spectra of {spectra.shape[1]} px ({spectra.dtype}), {n_bytes / 1e6:.1f} MB')
+    for compression in COMPRESSION_PRESETS:
+        filename = os.path.join(tempfile.mkdtemp(), 'temp.h5')
+        writer = SpectraWriter(flush_size)
+        writer.create(filename, layout, compression=compression)
+        t = time.perf_counter()
+        for i in range(n_buffers):
+            writer.append({key: rows[key][i * flush_size:(i + 1) * flush_size] for key in rows})
+        writer.close()
+        duration = time.perf_counter() - t
+        ratio = n_bytes / os.path.getsize(filename)
+        print(f'{compression:>15}: {n_bytes / 1e6 / duration:8.1f} MB/s, ratio {ratio:5.2f}')
+        os.remove(filename)
+
+
+benchmark('SpectrometerWorker', acquire(SpectrometerWorker(), 5))
+benchmark('StresingWorker', acquire(StresingWorker(), 5))
@@ -0,0 +1,75 @@
+"""
+Benchmark of the transposition of the temp file by the SaveWorker of the CSV DataHandling. The previous version
+stored the temp file as CSV with one row per spectrum and read it again with pandas for every 50 columns of the final
+file. The binary temp file with one block per buffer is transposed in a single pass with transpose_blocks. Both
+final files are compared.
+"""
+from pathlib import Path
+import sys
+import os
+import csv
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+path_root = Path(__file__).parents[2]
+sys.path.append(str(Path(path_root, 'src')))
+from DataHandling.DataHandling_csv import transpose_blocks
+
+n_parameter = 12
+speclength = 1024
+n_spectra = 5000
+buffer_size = 11  # spectra per buffer of the CSV DataHandling
+
+
+def write_temp_csv(filename, blocks):
+    # temp file as written by the previous version of save_buffer
+    np.savetxt(filename, blocks[0].transpose(), fmt='% 6.4f', delimiter=',')
+    with open(filename, 'a', newline='') as f:
+        writer = csv.writer(f)
+        for block in blocks[1:]:
+            writer.writerows(block.transpose())
+
+
+def transpose_pandas(from_file, to_file, n_columns, batch_size=50):
+    # transposition of the previous version of SaveWorker.run
+    for batch in range(n_columns // batch_size + bool(n_columns % batch_size)):
+        lcol = batch * batch_size
+        rcol = min(n_columns, lcol + batch_size)
+        data = pd.read_csv(from_file, usecols=range(lcol, rcol), header=None)
+        with open(to_file, 'a') as _f:
+            data.T.to_csv(_f, header=None, index=None)
+
+
+def write_temp_binary(filename, blocks):
+    with open(filename, 'wb') as f:
+        for block in blocks:
+            block.tofile(f)
+
+
+n_rows = n_parameter + speclength
+data = np.round(np.random.rand(n_rows, n_spectra) * 1000, 4)
+blocks = [data[:, i:i + buffer_size] for i in range(0, n_spectra, buffer_size)]
+folder = tempfile.mkdtemp()
+print(f'{n_spectra} spectra of {speclength} px and {n_parameter} parameters')
+
+t = time.perf_counter()
+write_temp_csv(os.path.join(folder, 'temp.csv'), blocks)
+t_write = time.perf_counter() - t
+t = time.perf_counter()
+transpose_pandas(os.path.join(folder, 'temp.csv'), os.path.join(folder, 'pandas.csv'), n_rows)
+t_transpose = time.perf_counter() - t
+print(f'CSV temp file + pandas batches: write {t_write:6.2f} s, transpose {t_transpose:6.2f} s')
+
+t = time.perf_counter()
+write_temp_binary(os.path.join(folder, 'temp.bin'), [np.ascontiguousarray(block) for block in blocks])
+t_write = time.perf_counter() - t
+t = time.perf_counter()
+transpose_blocks(os.path.join(folder, 'temp.bin'), os.path.join(folder, 'blocks.csv'), n_rows,
+                 [block.shape[1] for block in blocks])
+t_transpose = time.perf_counter() - t
+print(f'binary temp file + single pass: write {t_write:6.2f} s, transpose {t_transpose:6.2f} s')
+
+equal = np.allclose(np.loadtxt(os.path.join(folder, 'pandas.csv'), delimiter=','),
+                    np.loadtxt(os.path.join(folder, 'blocks.csv'), delimiter=','))
+print('Final files are equal: ' + str(equal))
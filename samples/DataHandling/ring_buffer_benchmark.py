@@ -0,0 +1,51 @@
+"""
+Benchmark of the spectrum buffering used in DataHandling.concatenate_data. Compares the former np.c_ concatenation
+with the preallocated SpectrumRingBuffer for a Stresing sized frame (1024 pixels) and reports sustained spectra/s.
+Only the in-memory buffering is measured, disk writing is identical for both.
+"""
+from pathlib import Path
+import sys
+import time
+import numpy as np
+path_root = Path(__file__).parents[2]
+sys.path.append(str(Path(path_root, 'src')))
+from DataHandling.SpectrumBuffer import SpectrumRingBuffer
+
+speclength = 1024
+n_parameter = 12
+flush_size = 100
+n_spectra = 20000
+spec = np.random.randint(0, 65535, speclength).astype(np.float64)
+param = np.random.rand(n_parameter, 1)
+
+
+def concatenate_legacy():
+    spectra = np.empty([speclength, 0])
+    parameter_measured = np.zeros([n_parameter, 0])
+    for i in range(n_spectra):
+        spectra = np.c_[spectra, spec]
+        parameter_measured = np.c_[parameter_measured, param]
+        if spectra.shape[1] == flush_size:
+            flushed = np.vstack([parameter_measured, spectra])
+            spectra = np.empty([speclength, 0])
+            parameter_measured = np.zeros([n_parameter, 0])
+    return flushed
+
+
+def concatenate_ring_buffer():
+    buffer = SpectrumRingBuffer(n_parameter + speclength, flush_size)
+    for i in range(n_spectra):
+        row = buffer.next_row()
+        row[:n_parameter] = param[:, 0]
+        row[n_parameter:] = spec
+        if buffer.is_full():
+            flushed = buffer.pending()
+            buffer.mark_flushed()
+    return flushed
+
+
+for name, function in [('np.c_ concatenation', concatenate_legacy), ('ring buffer', concatenate_ring_buffer)]:
+    t = time.perf_counter()
+    function()
+    duration = time.perf_counter() - t
+    print(f'{name:>22}: {n_spectra / duration:,.0f} spectra/s ({speclength} px, flush every {flush_size})')
@@ -0,0 +1,54 @@
+"""
+Reduction of a block of background scans (scans x pixels) to one background spectrum and its per pixel noise. All
+pixels are reduced at once along the scan axis:
+- 'mean': mean and standard deviation.
+- 'median': median and 1.4826 * median absolute deviation, insensitive to up to half of the scans being outliers.
+- 'sigma_clip': mean and standard deviation of the scans within clip_sigma standard deviations of the median. Removes
+  cosmic rays and glitches of single scans, also with few scans, where an outlier would inflate the plain standard
+  deviation. The standard deviation of a pixel is estimated robustly from the deviations of the pixels with the most
+  similar background level, such that it follows the shot noise and scatters little even with few scans.
+The noise is the standard deviation of a single scan, the uncertainty of the background is noise / sqrt(scans).
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+REDUCERS = ('mean', 'median', 'sigma_clip')
+
+
+def reduce_scans(block, method='mean', clip_sigma=3.):
+    """ Returns background, noise and the number of rejected values of block (scans x pixels)."""
+    if method not in REDUCERS:
+        print('Unknown background reducer ' + str(method) + ', using mean')
+        method = 'mean'
+    block = np.asarray(block, dtype=np.float64)
+    ddof = 1 if len(block) > 1 else 0
+    if method == 'median':
+        background = np.median(block, axis=0)
+        noise = 1.4826 * np.median(np.abs(block - background), axis=0)
+        return background, noise, 0
+    if method == 'sigma_clip' and len(block) > 2:
+        return sigma_clip(block, clip_sigma)
+    return np.mean(block, axis=0), np.std(block, axis=0, ddof=ddof), 0
+
+
+def sigma_clip(block, clip_sigma=3., neighbours=31):
+    """ Sigma clipped mean, standard deviation and number of rejected values of block along the scan axis."""
+    n_scans, n_pixels = block.shape
+    center = np.median(block, axis=0)
+    # standard deviation of each pixel: 1.4826 * median absolute deviation from the pixel means, pooled over the pixels
+    # closest in level. An outlier only shifts the deviations of its own pixel, a minority of the pooled values.
+    spread = np.abs(block - np.mean(block, axis=0))
+    order = np.argsort(center)
+    neighbours = min(neighbours, n_pixels)
+    windows = sliding_window_view(spread[:, order], neighbours, axis=1)  # scans x windows x neighbours
+    pooled = np.median(windows, axis=(0, 2))
+    first = np.clip(np.arange(n_pixels) - neighbours // 2, 0, n_pixels - neighbours)  # window centred on each pixel
+    scale = np.empty(n_pixels)
+    scale[order] = 1.4826 * pooled[first] / np.sqrt((n_scans - 1) / n_scans)  # deviations from the mean are smaller
+    rejected = np.abs(block - center) > clip_sigma * scale
+    masked = np.array(block)  # block with rejected values set to NaN
+    masked[rejected] = np.nan
+    n_kept = np.sum(~rejected, axis=0)
+    background = np.nanmean(masked, axis=0)
+    noise = np.nanstd(masked, axis=0, ddof=1) if np.all(n_kept > 1) else np.nanstd(masked, axis=0)
+    return background, noise, int(np.sum(rejected))
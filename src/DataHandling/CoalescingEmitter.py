@@ -0,0 +1,60 @@
+"""
+Forwarding of spectra to the GUI at display rate. At kHz acquisition rates, emitting every spectrum floods the Qt
+event loop with signals of frames that can not be shown anyway. A CoalescingEmitter forwards at most rate frames per
+second. Frames arriving in between replace each other, the latest one is delivered at the end of the interval, such
+that the display always ends on the last acquired spectrum. Only what is sent to the GUI is affected, not what is
+stored.
+"""
+import time
+import numpy as np
+from PyQt5 import QtCore
+
+
+class CoalescingEmitter(QtCore.QObject):
+    """ Forwards push(*args) to signal.emit(*args) at most rate times per second, rate 0 forwards every frame. Arrays
+    are copied when they are emitted, the caller may reuse them after push(). Must be used from the thread it was
+    created in."""
+
+    def __init__(self, signal, rate=30.):
+        super(CoalescingEmitter, self).__init__()
+        self.signal = signal
+        self.interval = 0
+        self.set_rate(rate)
+        self.pending = None  # arguments of the latest frame that was not emitted yet
+        self.last_emit = 0
+        self.n_pushed = 0
+        self.n_emitted = 0
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.emit_pending)
+
+    def set_rate(self, rate):
+        self.interval = 1. / rate if rate else 0
+
+    def push(self, *args):
+        self.n_pushed = self.n_pushed + 1
+        self.pending = args
+        wait = self.last_emit + self.interval - time.perf_counter()
+        if wait <= 0:
+            self.emit_pending()
+        elif not self.timer.isActive():
+            self.timer.start(int(np.ceil(wait * 1000)))
+
+    def emit_pending(self):
+        if self.pending is None:
+            return
+        args = [np.array(arg) if isinstance(arg, np.ndarray) else arg for arg in self.pending]
+        self.pending = None
+        self.last_emit = time.perf_counter()
+        self.n_emitted = self.n_emitted + 1
+        self.signal.emit(*args)
+
+    def coalesced(self):
+        """ Number of frames that were replaced by a later one and never emitted."""
+        return self.n_pushed - self.n_emitted - (self.pending is not None)
+
+    def reset_counters(self):
+        self.n_pushed = 0
+        self.n_emitted = 0
+        if self.pending is not None:
+            self.n_pushed = 1
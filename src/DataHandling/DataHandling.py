@@ -12,8 +12,21 @@ from PyQt5 import QtCore, QtWidgets
 import h5py
 import numpy as np
 import os.path
-from collections import deque
 import shutil
+import glob
+from DataHandling.SpectrumBuffer import SpectrumRingBuffer
+from DataHandling.ParameterHistory import ParameterHistory, minmax_decimate
+from DataHandling.WriterThread import WriterThread
+from DataHandling.SpectraWriter import COMPRESSION_PRESETS
+from DataHandling.Finalize import move_file, write_subset, move_stitched
+from DataHandling.DataLoader import RunReader
+from DataHandling.SpectralCorrection import SpectralCorrection
+from DataHandling.RunStatistics import RunStatistics
+from DataHandling.ParameterIndex import write_index
+from DataHandling.Journal import Journal, recover_journal
+from DataHandling.CoalescingEmitter import CoalescingEmitter
+from DataHandling.FramePool import FramePool
+from DataHandling.ParameterLog import ParameterLog, read_parameters
 """TO DOs: 
 - check if more specific functions for dataset creation are needed. 
 - think of a more clever way to store hardware parameters. Do we want it on command, a life-long storage, etc... 
@@ -25,135 +38,486 @@ class DataHandling(QtCore.QThread):
     sendSpectrum = QtCore.pyqtSignal(np.ndarray, np.ndarray)
     sendMaximum = QtCore.pyqtSignal(np.ndarray) # not used for now, to be implemented for direct measurment control
     sendParameterarray = QtCore.pyqtSignal(np.ndarray, np.ndarray)
+    sendParameterTail = QtCore.pyqtSignal(np.ndarray, np.ndarray)
 
-    def __init__(self, parameter, speclength):
+    def __init__(self, parameter, speclength, dtype=np.float64):
         super(DataHandling, self).__init__()
         self.parameter = parameter
         self.starttime = time.time()
 
         # initialize data arrays, their uses are explained in the corresponding functions
         self.speclength = speclength
-        self.parameter_queue = {} # initialize FIFO queues for parameter storage
-        self.parameter_queue['time'] = deque(maxlen=100000)
-        self.parameter_queue['absolute_time'] = deque(maxlen=100000)
-        for param in self.parameter:
-            self.parameter_queue[param] = deque(maxlen=100000)
-        self.param_from_deque = np.zeros([len(self.parameter) + 2, 1])
-        self.parameter_measured = np.zeros([len(self.parameter) + 2, 0])
-        self.spec = np.empty([self.speclength, 0])
-        self.background = np.empty([self.speclength, 1])
+        self.parameter_keys = ['time', 'absolute_time'] + list(self.parameter)
+        self.parameter_history = ParameterHistory(self.parameter_keys, 100000) # ring buffer for parameter storage
+        self.parameter_sample = np.zeros(len(self.parameter_keys))
+        self.parameter_join = 'asof'  # how parameters are assigned to spectra, 'asof' or 'interpolate'
+        # 'rows' stores the full parameter row of every spectrum, 'changes' only the times of the spectra and a change
+        # log with keyframes, see ParameterLog. Applied when the next temp file is created.
+        self.parameter_storage = 'rows'
+        self.parameter_log = ParameterLog(keyframe_interval=1000)
+        self.log_parameters = False
+        self.n_parameter = len(self.parameter_keys)
+        self.flush_size = 100
+        self.max_write_batches = 8
+        # spectra are kept in the type declared by the detector, parameters as float64. Both are written in place in
+        # preallocated buffers, one row per spectrum. Slots stay reserved while they wait in the writer queue, two more
+        # are needed for the written and filled ones.
+        self.dtype = np.dtype(dtype)
+        self.store_dtype = None  # type of the stored spectra if not native, set per measurement with clear_data
+        self.parameter_buffer = SpectrumRingBuffer(self.n_parameter, self.flush_size,
+                                                   n_slots=self.max_write_batches + 2)
+        self.buffer = SpectrumRingBuffer(self.speclength, self.flush_size, n_slots=self.max_write_batches + 2,
+                                         dtype=self.dtype)
         self.wls = np.empty([self.speclength, 1])
         self.maximum = np.zeros([3])
+        # corrections, set from the GUI. They are applied to whole batches when saving and fixed when the temp file is
+        # created. Corrected spectra are stored as float32, raw spectra are only stored as well if store_raw is set.
+        self.background = np.zeros(self.speclength)
+        self.transmission = np.ones(self.speclength)
         self.correct_background = False
+        self.transmission_option = 'no_corr'
+        self.store_raw = False
+        self.correction_enabled = True  # disabled for measurements that must not be corrected, e.g. backgrounds
+        self.correction = SpectralCorrection(self.speclength)
+        # displayed spectra are corrected with the current settings, reconfigured by the setters below when they
+        # change. self.correction stays as configured for the temp file until it is finalized.
+        self.display_correction = SpectralCorrection(self.speclength)
+        self.corrected = np.zeros([self.buffer.capacity, self.speclength], dtype=np.float32)
+        self.correction_active = False
+        # running statistics of the stored spectra, updated by the writer thread and saved with the data. Mean spectra
+        # are binned by the parameters in statistics_bins (key: bin width, 0 for one bin per value)
+        self.statistics_bins = {'time': 60.}
+        self.statistics = RunStatistics(self.speclength, self.parameter_keys, self.statistics_bins)
+        # spectra and maxima are sent to the GUI at most display_rate times per second, always ending on the latest
+        # spectrum. Stored data is not affected.
+        self.display_rate = 30.
+        self.spectrum_emitter = CoalescingEmitter(self.sendSpectrum, self.display_rate)
+        self.maximum_emitter = CoalescingEmitter(self.sendMaximum, self.display_rate)
+        # slots that measurements fill in place and hand over by index with receive_frame, wavelengths are only sent
+        # with set_wavelength when they change
+        self.frame_pool = FramePool(self.speclength, self.dtype, n_slots=64)
+        self.frame_wls = np.zeros(self.speclength)
+        self.n_received = 0  # spectra received since clear_data, compared with the sent ones for the backlog
+        # datasets a measurement adds to the saved file, name: (data, attributes). E.g. the per step times of a
+        # KineticMeasurement as "timeline" or the noise of a background as "noise".
+        self.datasets = {}
         self.send_x_idx = 'time'
         self.send_y_idx = 'absolute_time'
+        # ParameterPlot receives at most plot_points points, about its width in pixels. The full decimated series is
+        # sent every plot_refresh updates, only new samples are sent in between.
+        self.plot_points = 2000
+        self.plot_refresh = 20
+        self.plot_updates = 0
+        self.plot_start = 0  # first sample shown in ParameterPlot, moved when the plot is cleared
 
         # initialize parameter array
         self.parameter_matrix_full = False
-        self.data_in_flash = 0
         self.firstbuffer = True
         self.temp_filename = r"C:\Data\temp.h5"
         self.filename = 'test'
+        # 'copy' keeps the temp file and copies it when saving, such that every save contains all spectra since
+        # clear_data. 'rename' moves the temp file to its destination without copying, spectra acquired afterwards go
+        # to a new temp file and the next save only contains those.
+        self.finalize_mode = 'copy'
+        # compression of the spectra dataset, one of COMPRESSION_PRESETS. Applied when the next temp file is created.
+        self.compression = 'gzip'
+        # rollover of the temp file into shards every shard_spectra spectra or shard_bytes bytes of uncompressed data,
+        # 0 for one temp file. Saving then moves the shards and only writes a file of virtual datasets.
+        self.shard_spectra = 0
+        self.shard_bytes = 0
+        self.sharded = False
+        # the temp file stays open during the measurement, chunks match the flush window. Compression and writing
+        # run in a background thread, such that receiving spectra is not stalled every 100th spectrum. The file is
+        # written in SWMR mode, it can be followed from other processes with LiveReader.
+        self.writer = WriterThread(self.flush_size, self.max_write_batches, policy='stall', swmr=True)
+        self.writer.observers.append(self.update_statistics)
+        self.writer.start()
+        # every buffer is also appended to a journal, that is synced to disk every second. If the program crashes
+        # before the data is saved, the journal is converted to C:\Data\recovered_<date>.h5 at the next start. It is
+        # removed when the data is saved and when the program is closed normally, see close().
+        self.journal_enabled = True
+        self.journal = Journal(os.path.splitext(self.temp_filename)[0] + '.journal', sync_interval=1.)
+        self.journal_header = None  # arguments of Journal.create for the current temp file
+        self.recover()
 
         # initialize Calibration dict
         self.calibration = {}
 
     # main update device parameter function
     def update_parameter(self, parameter):
-        """ This is an important part of hardware parameter control. We use "deque" as efficient First-In-First-Out
-        Queues that allow to have a continuous acces to the last 100.000 hardware parameters. Each parameter has their
-        on deque object. Each time the update parameter function is called by the updater, the most updated value of the
-        hardware parameter is added to the deque"""
-        self.parameter_queue['time'].append(time.time() - self.starttime)
-        self.parameter_queue['absolute_time'].append(time.time())
-        for idx, param in enumerate(self.parameter):
-            self.parameter_queue[param].append(parameter[idx])
-        self.sendParameterarray.emit(np.array(self.parameter_queue[self.send_x_idx]), np.array(self.parameter_queue[self.send_y_idx]))
-
-    def clear_data(self):
-        """Each time a new measurement is started, DataHandling is reset."""
+        """ This is an important part of hardware parameter control. We use a columnar ring buffer (ParameterHistory)
+        that allows to have a continuous acces to the last 100.000 hardware parameters. Each time the update parameter
+        function is called by the updater, the most updated value of all hardware parameters is added as one sample.
+        Plots receive the series reduced to their resolution, or only the new sample between full refreshes."""
+        now = time.time()
+        self.parameter_sample[0] = now - self.starttime
+        self.parameter_sample[1] = now
+        self.parameter_sample[2:] = parameter
+        self.parameter_history.append(self.parameter_sample)
+        self.send_parameter_plot()
+
+    def send_parameter_plot(self):
+        n_shown = min(self.parameter_history.n_appended - self.plot_start, len(self.parameter_history))
+        if n_shown <= 0:
+            return
+        x_array = self.parameter_history.series(self.send_x_idx)[-n_shown:]
+        y_array = self.parameter_history.series(self.send_y_idx)[-n_shown:]
+        if n_shown <= self.plot_points or self.plot_updates % self.plot_refresh == 0:
+            self.sendParameterarray.emit(*minmax_decimate(x_array, y_array, self.plot_points))
+        else:
+            self.sendParameterTail.emit(x_array[-1:], y_array[-1:])
+        self.plot_updates = self.plot_updates + 1
+
+    def clear_data(self, store_dtype=None, correct=True):
+        """Each time a new measurement is started, DataHandling is reset. Pending writes are finished before the
+        temp file is removed. Spectra are stored in the native type of the detector, derived data such as averaged
+        backgrounds can be stored with store_dtype, e.g. np.float32. If correct is False, background and transmission
+        corrections are not applied during this measurement."""
         self.starttime = time.time()
-        self.spec = np.empty([self.speclength, 0])
+        self.store_dtype = store_dtype
+        self.correction_enabled = correct
+        self.datasets = {}
+        self.n_received = 0
+        buffer_dtype = self.dtype if store_dtype is None else np.dtype(store_dtype)
+        if self.buffer.data.dtype != buffer_dtype:
+            self.buffer = SpectrumRingBuffer(self.speclength, self.flush_size, n_slots=self.max_write_batches + 2,
+                                             dtype=buffer_dtype)
+        self.buffer.reset()
+        self.parameter_buffer.reset()
         self.firstbuffer = 1
-        self.parameter_measured = np.zeros([len(self.parameter) + 2, 0])
+        self.writer.close()
+        self.writer.flush()
+        self.writer.reset_counters()
+        self.spectrum_emitter.reset_counters()
+        self.maximum_emitter.reset_counters()
+        self.journal.remove()
+        base, extension = os.path.splitext(self.temp_filename)
+        for filename in [self.temp_filename] + glob.glob(base + '_shard*' + extension):
+            try:
+                os.remove(filename)
+            except:
+                pass
+
+    def close(self):
+        """ Called when the program is closed normally. Pending spectra are written to the temp file and the journal is
+        removed, such that nothing is recovered at the next start."""
+        self.writer.stop()
+        self.journal.remove()
+
+    def recover(self):
+        """ Converts a journal left by a crashed session into an HDF5 file next to the temp file. If this fails, the
+        journal is renamed to .failed, such that it is not removed by clear_data."""
+        if not os.path.exists(self.journal.filename):
+            return
+        timestamp = time.strftime("%Y_%m_%d_%H_%M_%S", time.localtime(os.path.getmtime(self.journal.filename)))
+        destination = os.path.join(os.path.dirname(self.journal.filename), 'recovered_' + timestamp + '.h5')
         try:
-            os.remove(self.temp_filename)
-        except:
-            pass
+            n_recovered = recover_journal(self.journal.filename, destination, self.flush_size, self.compression)
+            os.remove(self.journal.filename)
+            print('Unsaved data of the last session: ' + str(n_recovered) + ' spectra recovered as ' + destination)
+        except Exception as e:
+            print('Journal could not be recovered: ' + str(e))
+            os.replace(self.journal.filename, self.journal.filename + '.failed')
 
     def concatenate_data(self, wls, spec):
         """ This function concatenates all received spectra. it keeps the last 100 spectra directly accessible. If
         more than 100 spectra are acquired, they are buffersaved in a .h5 file, to prevent memory overload and allow
-        acquisiton of infinite spectra. """
-        # add data to data array, not used for now
-        curr_time = time.time() - self.starttime
+        acquisiton of infinite spectra. Spectra and parameters are written in place into the preallocated ring
+        buffers, no array is grown or copied here. """
+        now = time.time()
+        curr_time = now - self.starttime
+        self.n_received = self.n_received + 1
         self.wls = wls
-        self.spec = np.c_[self.spec, spec]
-        for idx, param in enumerate(self.parameter_queue.keys()):
-            self.param_from_deque[idx] = self.parameter_queue[param][-1]
-        self.parameter_measured = np.c_[self.parameter_measured, self.param_from_deque]
-        self.parameter_measured[0, -1] = curr_time
-        self.parameter_measured[1, -1] = time.time()
-        self.sendSpectrum.emit(wls, spec)
+        # only the time of the spectrum is recorded here, parameters are joined per batch in join_parameters
+        row = self.parameter_buffer.next_row()
+        row[0] = curr_time
+        row[1] = now
+        stored = self.buffer.next_row()
+        stored[:] = spec
+        spec = stored  # the received array may be reused by its producer, e.g. a slot of the frame pool
+        if self.correction_enabled and self.display_correction.is_active():
+            # only the displayed spectrum is corrected here, stored spectra are corrected per batch
+            spec = self.display_correction.apply_one(spec)
+        self.spectrum_emitter.push(wls, spec)
         # to prevent memory overload, save to temp file every 100th spectrum
-        self.data_in_flash =self.data_in_flash + 1
-        if self.data_in_flash > 99:
+        if self.buffer.is_full():
             self.save_buffer()
-            self.data_in_flash = 0
 
         # Extract maxima of data to display them in SpectrumViewer
         self.maximum[1] = np.amax(spec)
         self.maximum[2] = wls[np.argmax(spec)]
         self.maximum[0] = curr_time
-        self.sendMaximum.emit(self.maximum)
+        self.maximum_emitter.push(self.maximum)
+
+    def set_wavelength(self, wls):
+        # wavelengths of the following frames of the frame pool
+        self.frame_wls = np.array(wls)
+
+    def receive_frame(self, idx):
+        """ Receives a spectrum as index of a slot of the frame pool, the slot is free again once it is stored."""
+        try:
+            self.concatenate_data(self.frame_wls, self.frame_pool.slot(idx))
+        finally:
+            self.frame_pool.release(idx)
 
     # save data to temp file and clear data in memory
     def save_buffer(self):
         """ Saves data to a temporary file and populates it each time more than 100 spectra have been acquired.
-        If the file is created, some attributes such as yaxis and parameter keys are added."""
+        If the file is created, some attributes such as yaxis and parameter keys are added. The buffered spectra and
+        parameters are handed over as views on the ring buffers and queued for the writer thread, that appends them as
+        one chunk to the spectra and parameters datasets of the open temp file. If corrections are active, the batch
+        is corrected in one pass into a float32 buffer that is stored as spectra, raw spectra are stored next to them
+        if store_raw is set. The corrections are fixed when the temp file is created."""
+        self.join_parameters()
         # check for first buffer saving to initialize data array
         if self.firstbuffer:
-            spectrum_w_param = np.vstack([self.parameter_measured, self.spec])
-            print(np.shape(spectrum_w_param))
-            with h5py.File(self.temp_filename, 'w') as hf:
-                hf.create_dataset("spectra", data=spectrum_w_param, compression="gzip", chunks=True, maxshape=(np.shape(spectrum_w_param)[0],None))
-                hf["spectra"].attrs["yaxis"] = self.wls
-                hf["spectra"].attrs["parameter_keys"] = list(self.parameter_queue.keys())
-            print('First buffer saved')
+            self.configure_correction()
+            self.correction_active = self.correction_enabled and self.correction.is_active()
+            layout = {"parameters": (self.n_parameter, np.float64),
+                      "spectra": (self.speclength, self.buffer.data.dtype)}
+            attributes = {"parameters": {"parameter_keys": self.parameter_keys},
+                          "spectra": {"yaxis": self.wls}}
+            self.log_parameters = self.parameter_storage == 'changes'
+            if self.log_parameters:
+                self.parameter_log.reset()
+                layout["parameters"] = (2, np.float64)
+                layout["parameter_changes"] = (3, np.float64)
+                layout["parameter_keyframes"] = (self.n_parameter + 1, np.float64)
+                attributes["parameters"] = {"parameter_keys": self.parameter_keys[:2]}
+                attributes["parameter_changes"] = {"parameter_keys": self.parameter_keys,
+                                                   "columns": ['row', 'parameter', 'value']}
+                attributes["parameter_keyframes"] = {"keyframe_interval": self.parameter_log.keyframe_interval}
+            if self.correction_active:
+                layout["spectra"] = (self.speclength, np.float32)
+                attributes["spectra"].update(self.correction.attributes())
+                if self.store_raw:
+                    layout["raw_spectra"] = (self.speclength, self.buffer.data.dtype)
+                    attributes["raw_spectra"] = {"yaxis": self.wls}
+            rows = self.pending_rows()
+            self.journal_header = (self.parameter_keys, self.wls, self.speclength, layout["spectra"][1],
+                                   self.flush_size, {"correction": self.transmission_option}
+                                   if self.correction_active else None)
+            if self.open_journal():
+                self.write_journal(rows)
+            print(np.shape(rows["spectra"]))
+            self.writer.submit(self.statistics.reset)  # statistics cover the spectra of one temp file
+            self.sharded = bool(self.shard_spectra or self.shard_bytes)
+            self.writer.create(self.temp_filename, layout, attributes, self.compression, self.shard_spectra,
+                               self.shard_bytes)
+            self.writer.append(rows)
+            print('First buffer queued')
             self.firstbuffer = False
         else:
-            spectrum_w_param = np.vstack([self.parameter_measured, self.spec])
-            with h5py.File(self.temp_filename, 'a') as hf:
-                hf["spectra"].resize((hf["spectra"].shape[1] + spectrum_w_param.shape[1]), axis=1)
-                hf["spectra"][:,-spectrum_w_param.shape[1]:] = spectrum_w_param
+            rows = self.pending_rows()
+            self.write_journal(rows)
+            self.writer.append(rows)
+
+        # release buffered rows, they are overwritten by the next spectra
+        self.buffer.mark_flushed()
+        self.parameter_buffer.mark_flushed()
+
+    def join_parameters(self):
+        """ Fills the hardware parameters of the buffered spectra from the parameter history, by their absolute time.
+        With parameter_join 'asof', each spectrum gets the last sample before it, with 'interpolate' the values are
+        interpolated between the samples before and after it, if there is one already."""
+        pending = self.parameter_buffer.pending()
+        history = self.parameter_history.view()
+        n_samples = history.shape[1]
+        if n_samples == 0:
+            pending[:, 2:] = 0
+            return
+        sample_times = history[1]
+        spectrum_times = pending[:, 1]
+        idx = np.searchsorted(sample_times, spectrum_times, side='right') - 1
+        np.clip(idx, 0, None, out=idx)
+        if self.parameter_join == 'interpolate':
+            idx_next = np.minimum(idx + 1, n_samples - 1)
+            interval = sample_times[idx_next] - sample_times[idx]
+            weight = np.divide(spectrum_times - sample_times[idx], interval, out=np.zeros(len(idx)),
+                               where=interval > 0)
+            np.clip(weight, 0, 1, out=weight)
+            pending[:, 2:] = (history[2:, idx] * (1 - weight) + history[2:, idx_next] * weight).T
+        else:
+            pending[:, 2:] = history[2:, idx].T
 
-        # clear arrays in memory
-        self.spec = np.empty([self.speclength, 0])
-        self.parameter_measured = np.zeros([len(self.parameter) + 2, 0])
+    def pending_rows(self):
+        # rows to be written, views on the ring buffers. Corrected rows use the same slots as the raw ones. The full
+        # parameter rows are also passed as parameter_table for the journal and the statistics, they are not a dataset.
+        parameter_table = self.parameter_buffer.pending()
+        rows = {"parameters": parameter_table, "spectra": self.buffer.pending(), "parameter_table": parameter_table}
+        if self.log_parameters:
+            rows["parameters"] = parameter_table[:, :2]
+            changes, keyframes = self.parameter_log.encode(parameter_table)
+            if len(changes):
+                rows["parameter_changes"] = changes
+            if len(keyframes):
+                rows["parameter_keyframes"] = keyframes
+        if self.correction_active:
+            corrected = self.corrected[self.buffer.flush_idx:self.buffer.write_idx]
+            self.correction.apply(rows["spectra"], corrected)
+            if self.store_raw:
+                rows["raw_spectra"] = rows["spectra"]
+            rows["spectra"] = corrected
+        return rows
+
+    def open_journal(self):
+        # starts a new journal for the following spectra of the temp file, returns whether it is open
+        self.journal.remove()
+        if not self.journal_enabled or self.journal_header is None:
+            return False
+        try:
+            self.journal.create(*self.journal_header)
+            return True
+        except OSError as e:
+            print('Journal could not be created, data is not protected against crashes: ' + str(e))
+            return False
+
+    def write_journal(self, rows):
+        # the journal is written before the rows are queued, syncing to disk is left to the writer thread
+        if self.journal.is_open() and self.journal.append(rows["parameter_table"], rows["spectra"]):
+            self.writer.submit(self.journal.sync)
+
+    def update_statistics(self, rows):
+        # called by the writer thread with each appended batch
+        self.statistics.update(rows["parameter_table"], rows["spectra"])
+
+    def set_statistics_bins(self, key, width=0.):
+        """ Adds binned mean spectra of parameter key to the statistics, from the next measurement on."""
+        self.statistics_bins[key] = width
+
+    def save_selected_parameters(self, source, destination, selection):
+        """ Replaces the time columns in a subset file by the full parameter rows of the selection, the change log of
+        the source refers to rows of the source."""
+        with h5py.File(source, 'r') as hf:
+            parameters = read_parameters(hf)
+        rows = np.arange(len(parameters))[selection]
+        with h5py.File(destination, 'a') as hf:
+            del hf["parameters"]
+            hf.create_dataset("parameters", data=parameters[rows])
+            hf["parameters"].attrs["parameter_keys"] = self.parameter_keys
+
+    def move_temp(self, destination, copy=False):
+        """ Moves or copies the closed temp file, with its shards if it is sharded. Returns True if it was renamed."""
+        if self.sharded:
+            return move_stitched(self.temp_filename, destination, copy)
+        if copy:
+            shutil.copyfile(self.temp_filename, destination)
+            return False
+        return move_file(self.temp_filename, destination)
+
+    def save_statistics(self, filename):
+        """ Writes the running statistics of the temp file into the group "statistics" of the saved file. The
+        writer must be flushed before."""
+        try:
+            with h5py.File(filename, 'a') as file:
+                if "statistics" in file:
+                    del file["statistics"]
+                self.statistics.write(file.create_group("statistics"))
+        except Exception as e:
+            print('Statistics could not be saved: ' + str(e))
+
+    def add_dataset(self, name, data, attributes):
+        # dataset written into the saved file of the current measurement, attributes is a dict
+        self.datasets[name] = (np.array(data), attributes)
+
+    def set_timeline(self, timeline, attributes):
+        # nominal and actual times of the steps of the measurement, attributes describe the columns
+        self.add_dataset("timeline", timeline, attributes)
+
+    def save_datasets(self, filename):
+        """ Writes the datasets added by the measurement, e.g. its timeline, into the saved file."""
+        try:
+            with h5py.File(filename, 'a') as file:
+                for name, (data, attributes) in self.datasets.items():
+                    if name in file:
+                        del file[name]
+                    dataset = file.create_dataset(name, data=data)
+                    for key, value in attributes.items():
+                        dataset.attrs[key] = value
+        except Exception as e:
+            print('Datasets of the measurement could not be saved: ' + str(e))
+
+    def save_index(self, filename):
+        """ Writes the parameter index into the group "index" of the saved file, see ParameterIndex."""
+        try:
+            with h5py.File(filename, 'a') as file:
+                write_index(file, self.flush_size)
+        except Exception as e:
+            print('Parameter index could not be saved: ' + str(e))
+
+    def configure_correction(self, correction=None):
+        # pass the correction settings of the GUI to a correction stage, by default the one of the stored spectra
+        correction = self.correction if correction is None else correction
+        correction.configure(self.background if self.correct_background else None, self.transmission_option,
+                             self.transmission if self.transmission_option != 'no_corr' else None)
+
+    def set_background(self, background):
+        # background spectrum, subtracted if correct_background is set. Stored spectra use it from the next temp file.
+        self.background = np.array(background, dtype=np.float64).reshape(-1)
+        self.configure_correction(self.display_correction)
+
+    def set_correct_background(self, correct_background):
+        self.correct_background = correct_background
+        self.configure_correction(self.display_correction)
+
+    def set_transmission_option(self, transmission_option):
+        self.transmission_option = transmission_option
+        self.configure_correction(self.display_correction)
+
+    def set_reference(self, reference):
+        # reference spectrum for the transmission options, e.g. a spectrum without sample
+        self.transmission = np.array(reference, dtype=np.float64).reshape(-1)
+        self.configure_correction(self.display_correction)
 
     def save_parameter(self, filename):
         """ Saves parameters to an independent .h5 file. We still might want to adapt how this is handled."""
-        save_length = len(self.parameter_queue['time'])
-        save_array = np.empty((len(self.parameter_queue), save_length))
-        for idx, param in enumerate(self.parameter_queue.keys()):
-            save_array[idx, :] = np.array(self.parameter_queue[param])[0:save_length]
+        save_array = self.parameter_history.view()
         ty_res = time.localtime(time.time())
         timestamp = time.strftime("%H_%M_%S", ty_res)
         with h5py.File( filename + '_' + timestamp + '_parameters.h5', 'w') as hf:
             hf.create_dataset("Parameter", data=save_array, compression="gzip", chunks=True)
-            hf['Parameter'].attrs["parameter_keys"] = list(self.parameter_queue.keys())
+            hf['Parameter'].attrs["parameter_keys"] = self.parameter_keys
         np.savetxt(filename, save_array)
         print('Parameter saved as: ' + filename)
 
     @QtCore.pyqtSlot(str, str)
-    def save_data(self, filename, comments):
-        """saves data. Each time data is saved, parameters are saved aswell. """
+    def save_data(self, filename, comments, selection=None):
+        """saves data. Each time data is saved, parameters are saved aswell. The writer queue is flushed and the
+        temp file closed before it is finalized. In 'rename' mode, the temp file is moved to the destination without
+        copying, spectra acquired afterwards go to a new temp file. If a selection of spectra (slice or indices) is
+        given, the temp file is moved next to the destination as _source.h5 and the destination only contains a
+        virtual dataset of the selected spectra. The running statistics of all spectra of the temp file are added to
+        the saved file, as well as an index of the parameter values and the datasets added by the measurement. """
         self.save_buffer()
-        with h5py.File(self.temp_filename, 'a') as hf:
-            hf.attrs["comments"] = comments
+        self.writer.set_file_attribute("comments", comments)
+        self.writer.close()
+        self.writer.flush()
+        if self.writer.dropped_spectra:
+            print('WARNING ' + str(self.writer.dropped_spectra) + ' spectra were dropped by the writer')
+        if self.writer.error is not None:
+            print('WARNING writing the temp file failed: ' + str(self.writer.error))
         ty_res = time.localtime(time.time())
         timestamp = time.strftime("%H_%M_%S", ty_res)
-        shutil.copyfile(self.temp_filename, filename + '_' + timestamp + '.h5')
+        destination = filename + '_' + timestamp + '.h5'
+        if selection is not None:
+            source = filename + '_' + timestamp + '_source.h5'
+            self.move_temp(source)
+            write_subset(source, destination, selection)
+            if self.log_parameters:
+                self.save_selected_parameters(source, destination, selection)
+            self.firstbuffer = True
+            self.journal.remove()
+        elif self.finalize_mode == 'rename':
+            if not self.move_temp(destination):
+                print('Temp file and destination are on different drives, temp file was copied')
+            self.firstbuffer = True
+            self.journal.remove()
+        else:
+            self.move_temp(destination, copy=True)
+            self.open_journal()  # saved spectra need no recovery, the journal covers the ones that follow
+        self.save_statistics(destination)
+        self.save_index(destination)
+        self.save_datasets(destination)
         self.save_parameter(filename)
         print('Data saved ')
 
@@ -172,13 +536,46 @@ class DataHandling(QtCore.QThread):
     def add_attribute(self,attribute):
         # to be used from measurment each attribute should consist of a tuple of name and content
         attribute_name, attribute_value = attribute
-        with h5py.File(self.temp_filename, 'a') as hf:
-            hf["spectra"].attrs[attribute_name] = attribute_value
+        self.writer.set_attribute(attribute_name, attribute_value)
+
+    def set_display_rate(self, rate):
+        # maximum number of spectra per second sent to the GUI, 0 sends every spectrum
+        self.display_rate = rate
+        self.spectrum_emitter.set_rate(rate)
+        self.maximum_emitter.set_rate(rate)
+
+    def backlog(self, n_sent):
+        """ Number of spectra waiting to be stored, of the n_sent spectra a measurement has sent since clear_data.
+        Counts the spectra not yet received and the ones in the writer queue. Called from the measurement thread."""
+        return max(n_sent - self.n_received, 0) + self.writer.queue_depth() * self.flush_size
+
+    def coalesced_frames(self):
+        """ Number of spectra of the current measurement that were not sent to the GUI, because a later one replaced
+        them within the display interval."""
+        return self.spectrum_emitter.coalesced()
+
+    def set_compression(self, compression):
+        # to be used from measurements, choose the compression of the spectra before the measurement starts.
+        if compression in COMPRESSION_PRESETS:
+            self.compression = compression
+        else:
+            print('Unknown compression ' + str(compression) + ', available: ' + ', '.join(COMPRESSION_PRESETS))
 
     def change_send_idx(self, x_idx, y_idx):
         # this function changes the parameter that are sent to parameter display.
-        self.send_x_idx = list(self.parameter_queue)[x_idx]
-        self.send_y_idx = list(self.parameter_queue)[y_idx]
+        self.send_x_idx = self.parameter_keys[x_idx]
+        self.send_y_idx = self.parameter_keys[y_idx]
+        self.plot_updates = 0  # send full series with the next update
+
+    def set_plot_start(self):
+        # called when ParameterPlot is cleared, only samples acquired afterwards are sent.
+        self.plot_start = self.parameter_history.n_appended
+        self.plot_updates = 0
+
+    def set_plot_points(self, plot_points):
+        # number of points sent to ParameterPlot, changed when the plot is resized.
+        self.plot_points = max(int(plot_points), 100)
+        self.plot_updates = 0
 
     def overwrite_popup(self):
         # not used currently, as time stamp prevents to have overwrite scenarios.
@@ -195,8 +592,9 @@ class DataHandling(QtCore.QThread):
             print('Cancel')
             return False
 
-    def load_data(self):
-        pass
+    def load_data(self, filename):
+        """ Opens a saved run. The file is read lazily, see RunReader for access by index, time or parameters."""
+        return RunReader(filename)
 """
 class SaveWorker(QtCore.QThread):
 
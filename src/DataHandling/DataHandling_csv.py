@@ -4,11 +4,9 @@ arrange and store data. Saves Data in a temp file during data acquirement to pre
 Sends Data to Data and Live Viewers.
 """
 import time
-import csv
 from PyQt5 import QtCore, QtWidgets
 import numpy as np
 import os.path
-import pandas as pd
 from collections import deque
 
 
@@ -50,7 +48,10 @@ class DataHandling(QtCore.QThread):
         self.parameter_matrix_full = False
         self.data_in_flash = 0
         self.firstbuffer = True
-        self.temp_filename = r"C:\Data\temp.csv"
+        # the temp file is binary, each buffer is appended as one block of (rows x spectra) float64 values. Rows of
+        # the final CSV file are then contiguous in each block and the file is transposed in a single pass.
+        self.temp_filename = r"C:\Data\temp_csv.bin"
+        self.block_widths = []  # number of spectra of each block in the temp file
         self.filename = 'test'
 
     def run(self):
@@ -74,6 +75,7 @@ class DataHandling(QtCore.QThread):
         self.starttime = time.time()
         self.spec = np.empty([self.speclength, 1])
         self.firstbuffer = 1
+        self.block_widths = []
         self.parameter_measured = np.zeros([len(self.parameter) + 2, 1])
         try:
             os.remove(self.temp_filename)
@@ -126,14 +128,11 @@ class DataHandling(QtCore.QThread):
         spectrum_w_param = np.vstack([self.parameter_measured, spectrum])
         self.spectrumlength = np.shape(spectrum_w_param)  # required for data transpose
 
-        # save to temp file
-        if self.firstbuffer:
-            np.savetxt(self.temp_filename, spectrum_w_param.transpose(), fmt='% 6.4f', delimiter=',')
-            self.firstbuffer = False
-        else:
-            with open(self.temp_filename, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerows(spectrum_w_param.transpose())
+        # save to temp file, as is without transposing
+        with open(self.temp_filename, 'wb' if self.firstbuffer else 'ab') as f:
+            np.ascontiguousarray(spectrum_w_param, dtype=np.float64).tofile(f)
+        self.block_widths.append(spectrum_w_param.shape[1])
+        self.firstbuffer = False
 
         # clear arrays in memory
         self.spec = np.empty([self.speclength, 1])
@@ -150,7 +149,8 @@ class DataHandling(QtCore.QThread):
     @QtCore.pyqtSlot(str, str)
     def save_data(self, filename, comments):
         self.save_buffer()
-        self.save_worker_thread = SaveWorker(filename, comments, self.parameter, self.spectrumlength, self.temp_filename)
+        self.save_worker_thread = SaveWorker(filename, comments, self.parameter, self.spectrumlength, self.temp_filename,
+                                             list(self.block_widths))
         self.save_worker_thread.start()
         print('thread started')
 
@@ -175,15 +175,36 @@ class DataHandling(QtCore.QThread):
     def load_data(self):
         pass
 
+def transpose_blocks(from_file, to_file, n_rows, block_widths, fmt='%.15g', max_memory=64e6):
+    """ Writes the blocks of the binary temp file side by side as CSV file with n_rows rows. Each block is a row-major
+    (n_rows x width) float64 array, such that a group of rows is one contiguous range per block. Groups of rows are
+    read from all blocks and written, the temp file is read once and at most max_memory bytes are held in memory."""
+    n_columns = sum(block_widths)
+    offsets = np.r_[0, np.cumsum(block_widths)[:-1]] * n_rows * 8  # byte offset of each block
+    group_rows = int(max(1, min(n_rows, max_memory // (8 * max(n_columns, 1)))))
+    rows = np.empty([group_rows, n_columns])
+    with open(from_file, 'rb') as source, open(to_file, 'w') as destination:
+        for first_row in range(0, n_rows, group_rows):
+            n_group = min(group_rows, n_rows - first_row)
+            column = 0
+            for offset, width in zip(offsets, block_widths):
+                source.seek(int(offset) + first_row * width * 8)
+                block = np.fromfile(source, dtype=np.float64, count=n_group * width)
+                rows[:n_group, column:column + width] = block.reshape(n_group, width)
+                column = column + width
+            np.savetxt(destination, rows[:n_group], fmt=fmt, delimiter=',')
+
+
 class SaveWorker(QtCore.QThread):
 
-    def __init__(self, filename, comments, parameter, spectrumlength, temp_filename):
+    def __init__(self, filename, comments, parameter, spectrumlength, temp_filename, block_widths):
         super(SaveWorker, self).__init__()
         self.filename = filename
         self.comments = comments
         self.parameter = parameter
         self.spectrumlength = spectrumlength
         self.temp_filename = temp_filename
+        self.block_widths = block_widths  # blocks written up to now, the temp file may grow while saving
         print('SAVE started')
 
     def run(self):
@@ -200,16 +221,9 @@ class SaveWorker(QtCore.QThread):
             for param in self.parameter.keys():
                 file.write(param + ': ' + str(self.parameter[param]) + '\n')
 
-        # transpose data from temp file to final file. Saving in rows is faster than in columns
-        # convert CSV with rows to columns using batches (required for large files)
-        NCOLS = self.spectrumlength[0]  # The exact number of columns
-        batch_size = 50
+        # transpose data from temp file to final file: one row per parameter and pixel, one column per spectrum.
+        # The temp file stores one block per buffer, rows of the final file are contiguous in each block.
         to_file = self.filename + '_' + timestamp + '.csv'
-        for batch in range(NCOLS // batch_size + bool(NCOLS % batch_size)):
-            lcol = batch * batch_size
-            rcol = min(NCOLS, lcol + batch_size)
-            data = pd.read_csv(from_file, usecols=range(lcol, rcol), header=None)
-            with open(to_file, 'a') as _f:
-                data.T.to_csv(_f, header=None, index=None) # , line_terminator='\n'
+        transpose_blocks(from_file, to_file, self.spectrumlength[0], self.block_widths)
         print('Data saved as: ' + to_file)
         return
\ No newline at end of file
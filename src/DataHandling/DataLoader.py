@@ -0,0 +1,162 @@
+"""
+Reader for saved runs. Files are opened lazily, only the parameter table is read when needed and spectra are read
+by index range, time window or parameter condition, such that only the required chunks are loaded. Long runs can thus
+be inspected without loading the whole file into memory. Uncompressed spectra can be memory-mapped. Conditions on
+parameters are resolved with the parameter index of the file, if it has one, instead of scanning the parameter table.
+
+Example:
+    run = RunReader('C:/Data/test_12_00_00.h5')
+    spectra = run.spectra(0, 100)
+    parameters, spectra = run.time_window(10., 20.)
+    parameters, spectra = run.where({'set_T': (10, 12)})
+    rows, ranges = run.query({'set_T': (10, 12), 'central_wave': 600})
+"""
+import h5py
+import numpy as np
+from DataHandling.Finalize import selection_to_ranges
+from DataHandling.ParameterIndex import query_index, chunk_ranges
+from DataHandling.ParameterLog import has_log, read_parameters, parameter_keys
+
+
+class RunReader:
+    """ Lazy reader of a file saved by DataHandling. With memmap, spectra of uncompressed datasets are returned as
+    views on a memory map of the file instead of being read."""
+
+    def __init__(self, filename, memmap=True):
+        self.filename = filename
+        self.file = h5py.File(filename, 'r', libver='latest')
+        self.spectra_dataset = self.file["spectra"]
+        self.parameter_dataset = self.file["parameters"]
+        self.n_spectra = self.spectra_dataset.shape[0]
+        self.wavelength = self.spectra_dataset.attrs["yaxis"]
+        self.parameter_keys = parameter_keys(self.file)
+        self.parameter_log = has_log(self.file)  # parameters stored as change log, see ParameterLog
+        self.comments = self.file.attrs.get("comments", "")
+        self.parameter_table = None  # read on first use
+        self.index = self.file.get("index")  # parameter index, None for files saved without
+        if self.index is not None:
+            self.chunk_rows = int(self.index.attrs["chunk_rows"])
+        else:
+            self.chunk_rows = self.spectra_dataset.chunks[0] if self.spectra_dataset.chunks else 100
+        self.memmaps = self.map_chunks() if memmap else None
+
+    def map_chunks(self):
+        """ Returns a list of (first row, memory map) of the spectra dataset, if it is stored without filters. The
+        dataset is either contiguous, one map, or chunked with chunks covering whole rows, one map per chunk."""
+        dataset = self.spectra_dataset
+        if dataset.is_virtual or dataset.compression is not None or dataset.shuffle or self.n_spectra == 0:
+            return None
+        if dataset.chunks is None:
+            offset = dataset.id.get_offset()
+            if offset is None:
+                return None
+            return [(0, np.memmap(self.filename, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape))]
+        chunk_rows, row_length = dataset.chunks
+        if row_length != dataset.shape[1]:
+            return None
+        memmaps = []
+        for idx in range(dataset.id.get_num_chunks()):
+            info = dataset.id.get_chunk_info(idx)
+            memmaps.append((info.chunk_offset[0], np.memmap(self.filename, dtype=dataset.dtype, mode='r',
+                                                            offset=info.byte_offset,
+                                                            shape=(chunk_rows, row_length))))
+        memmaps.sort(key=lambda item: item[0])
+        return memmaps
+
+    def read_rows(self, start, stop):
+        # read rows of the spectra, from the memory maps if possible
+        if self.memmaps is None:
+            return self.spectra_dataset[start:stop]
+        parts = []
+        for first_row, memmap in self.memmaps:
+            last_row = first_row + memmap.shape[0]
+            if last_row > start and first_row < stop:
+                parts.append(memmap[max(start - first_row, 0):min(stop, last_row) - first_row])
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts) if parts else np.empty((0, self.spectra_dataset.shape[1]),
+                                                             self.spectra_dataset.dtype)
+
+    def parameters(self, key=None):
+        """ Returns the parameter table (n_spectra x n_parameter), or one column if key is given. A change log is
+        reconstructed to the full table."""
+        if self.parameter_table is None:
+            self.parameter_table = read_parameters(self.file)
+        if key is None:
+            return self.parameter_table
+        return self.parameter_table[:, self.parameter_keys.index(key)]
+
+    def spectra(self, start=0, stop=None):
+        """ Returns the spectra with index start to stop (excluded)."""
+        start, stop, step = slice(start, stop).indices(self.n_spectra)
+        return self.read_rows(start, stop)
+
+    def spectrum(self, idx):
+        return self.spectra(idx % self.n_spectra, idx % self.n_spectra + 1)[0]
+
+    def select(self, indices):
+        """ Returns parameters and spectra of the given indices. Contiguous indices are read together."""
+        indices = np.unique(np.asarray(indices, dtype=np.int64))
+        ranges = selection_to_ranges(indices, self.n_spectra)
+        if len(ranges) == 1:
+            spectra = self.read_rows(*ranges[0])
+        elif ranges:
+            spectra = np.concatenate([self.read_rows(start, stop) for start, stop in ranges])
+        else:
+            spectra = np.empty((0, self.spectra_dataset.shape[1]), self.spectra_dataset.dtype)
+        if self.parameter_table is None and ranges:  # only read the selected parameters
+            parameters = np.concatenate([read_parameters(self.file, start, stop) for start, stop in ranges])
+        else:
+            parameters = self.parameters()[indices]
+        return parameters, spectra
+
+    def time_window(self, t_start, t_stop, key='time'):
+        """ Returns parameters and spectra acquired between t_start and t_stop. Time parameters are increasing, the
+        window is found by bisection."""
+        times = self.parameters(key)
+        start, stop = np.searchsorted(times, [t_start, t_stop], side='left')
+        return self.parameters()[start:stop], self.spectra(start, stop)
+
+    def find(self, condition):
+        """ Returns the indices of spectra matching condition. Condition is either a function that receives the
+        parameter table and returns a boolean mask, or a dict of key: value or key: (min, max). Dict conditions are
+        resolved with the parameter index if the file has one."""
+        if not callable(condition) and self.index is not None and all(key in self.index for key in condition):
+            return query_index(self.index, condition)
+        if callable(condition):
+            mask = condition(self.parameters())
+        else:
+            mask = np.ones(self.n_spectra, dtype=bool)
+            for key, value in condition.items():
+                column = self.parameters(key)
+                if isinstance(value, (tuple, list)):
+                    mask = mask & (column >= value[0]) & (column <= value[1])
+                else:
+                    mask = mask & (column == value)
+        return np.flatnonzero(mask)
+
+    def query(self, condition):
+        """ Returns the indices of spectra matching condition, see find(), and the list of (start, stop) ranges of
+        whole chunks that contain them, e.g. to read the matching spectra chunk by chunk."""
+        rows = self.find(condition)
+        return rows, chunk_ranges(rows, self.chunk_rows, self.n_spectra)
+
+    def where(self, condition):
+        """ Returns parameters and spectra matching condition, see find()."""
+        return self.select(self.find(condition))
+
+    def statistics(self):
+        """ Returns the running statistics stored with the run as dict, e.g. statistics()['mean'], binned mean spectra
+        as statistics()['binned'][key] = (bins, counts, mean). Empty if the run has no statistics."""
+        if "statistics" not in self.file:
+            return {}
+        group = self.file["statistics"]
+        result = {name: group[name][:] for name in ("mean", "variance", "min", "max")}
+        result["count"] = group.attrs["count"]
+        result["binned"] = {key: (binned["bins"][:], binned["counts"][:], binned["mean"][:])
+                            for key, binned in group.get("binned", {}).items()}
+        return result
+
+    def close(self):
+        self.memmaps = None
+        self.file.close()
@@ -0,0 +1,133 @@
+"""
+Finalization of the temp .h5 file when data is saved. Copying the temp file doubles the disk I/O of a measurement,
+so the temp file is moved to its destination instead whenever possible. Subsets of the spectra are saved as a small
+file containing virtual datasets that point to the moved temp file, no spectrum is copied. A temp file split into
+shards is finalized by moving the shards and writing a new file of virtual datasets that stitches them together.
+"""
+import os
+import shutil
+import h5py
+import numpy as np
+
+
+def move_file(source, destination):
+    """ Atomically renames source to destination. Renaming is not possible across file systems, the file is copied
+    and removed in that case. Returns True if the file was renamed."""
+    try:
+        os.replace(source, destination)
+        return True
+    except OSError:
+        shutil.copyfile(source, destination)
+        os.remove(source)
+        return False
+
+
+def selection_to_ranges(selection, n_rows):
+    """ Converts a slice or an array of row indices into a list of contiguous (start, stop) ranges."""
+    if isinstance(selection, slice):
+        start, stop, step = selection.indices(n_rows)
+        if step == 1:
+            return [(start, stop)] if stop > start else []
+        rows = np.arange(start, stop, step)
+    else:
+        rows = np.unique(np.asarray(selection, dtype=np.int64))
+    if len(rows) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    starts = np.r_[rows[0], rows[breaks]]
+    stops = np.r_[rows[breaks - 1], rows[-1]] + 1
+    return list(zip(starts.tolist(), stops.tolist()))
+
+
+def write_subset(source, destination, selection, dataset_names=("parameters", "spectra")):
+    """ Writes destination as a file with virtual datasets, that contain the selected rows of the datasets in source.
+    Attributes of the file and of the datasets are copied. Source is referenced relative to destination, both files
+    have to be kept in the same folder."""
+    with h5py.File(source, 'r') as hf:
+        shapes = {name: hf[name].shape for name in dataset_names}
+        dtypes = {name: hf[name].dtype for name in dataset_names}
+        dataset_attributes = {name: dict(hf[name].attrs) for name in dataset_names}
+        file_attributes = dict(hf.attrs)
+    n_rows = shapes[dataset_names[0]][0]
+    ranges = selection_to_ranges(selection, n_rows)
+    n_selected = sum(stop - start for start, stop in ranges)
+    with h5py.File(destination, 'w', libver='latest') as hf:
+        for name in dataset_names:
+            row_length = shapes[name][1]
+            layout = h5py.VirtualLayout(shape=(n_selected, row_length), dtype=dtypes[name])
+            virtual_source = h5py.VirtualSource(os.path.basename(source), name, shape=shapes[name])
+            position = 0
+            for start, stop in ranges:
+                layout[position:position + stop - start] = virtual_source[start:stop]
+                position = position + stop - start
+            hf.create_virtual_dataset(name, layout)
+            for attribute_name, value in dataset_attributes[name].items():
+                hf[name].attrs[attribute_name] = value
+        for name, value in file_attributes.items():
+            hf.attrs[name] = value
+        hf.attrs["source_file"] = os.path.basename(source)
+
+
+def write_stitched(destination, shard_files):
+    """ Writes destination as a file with virtual datasets, that contain the datasets of all shards one after the
+    other. Attributes of the file and of the datasets are taken from the first shard, the file names of the shards are
+    stored in the attribute "shards". Shards are referenced by name, they have to be kept in the folder of
+    destination."""
+    with h5py.File(shard_files[0], 'r') as hf:
+        dataset_names = [name for name in hf if isinstance(hf[name], h5py.Dataset)]
+        row_lengths = {name: hf[name].shape[1] for name in dataset_names}
+        dtypes = {name: hf[name].dtype for name in dataset_names}
+        dataset_attributes = {name: dict(hf[name].attrs) for name in dataset_names}
+        file_attributes = dict(hf.attrs)
+    n_rows = {name: [] for name in dataset_names}  # rows of each dataset in each shard
+    for shard in shard_files:
+        with h5py.File(shard, 'r') as hf:
+            for name in dataset_names:
+                n_rows[name].append(hf[name].shape[0])
+    with h5py.File(destination, 'w', libver='latest') as hf:
+        for name in dataset_names:
+            layout = h5py.VirtualLayout(shape=(sum(n_rows[name]), row_lengths[name]), dtype=dtypes[name])
+            position = 0
+            for shard, n in zip(shard_files, n_rows[name]):
+                if n:
+                    layout[position:position + n] = h5py.VirtualSource(os.path.basename(shard), name,
+                                                                       shape=(n, row_lengths[name]))
+                position = position + n
+            hf.create_virtual_dataset(name, layout)
+            for attribute_name, value in dataset_attributes[name].items():
+                hf[name].attrs[attribute_name] = value
+        for name, value in file_attributes.items():
+            hf.attrs[name] = value
+        hf.attrs["shards"] = [os.path.basename(shard) for shard in shard_files]
+
+
+def move_stitched(source, destination, copy=False):
+    """ Moves (or copies) a stitched file written by SpectraWriter and its shards to destination. Shards are renamed
+    to <destination>_shard00000.h5, ..., the stitched file is written again for the new names and keeps its attributes.
+    Returns True if all shards were renamed."""
+    folder = os.path.dirname(source)
+    with h5py.File(source, 'r') as hf:
+        shards = [os.path.join(folder, name) for name in hf.attrs["shards"]]
+        file_attributes = dict(hf.attrs)
+        dataset_attributes = {name: dict(hf[name].attrs) for name in hf if isinstance(hf[name], h5py.Dataset)}
+    base, extension = os.path.splitext(destination)
+    moved_shards = []
+    renamed = True
+    for idx, shard in enumerate(shards):
+        moved_shards.append(base + '_shard' + str(idx).zfill(5) + extension)
+        if copy:
+            shutil.copyfile(shard, moved_shards[-1])
+            renamed = False
+        else:
+            renamed = move_file(shard, moved_shards[-1]) and renamed
+    write_stitched(destination, moved_shards)
+    with h5py.File(destination, 'a') as hf:
+        for name, value in file_attributes.items():
+            if name != "shards":
+                hf.attrs[name] = value
+        for name, attributes in dataset_attributes.items():
+            for attribute_name, value in attributes.items():
+                hf[name].attrs[attribute_name] = value
+    if not copy:
+        os.remove(source)
+    return renamed
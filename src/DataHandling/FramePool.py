@@ -0,0 +1,68 @@
+"""
+Preallocated pool of spectrum slots to hand frames from a measurement thread to DataHandling without allocating and
+sending a new array for every spectrum. The producer takes a free slot with acquire(), fills it in place, e.g. with
+get_intensities(out=slot), and sends only the slot index. The consumer reads the slot and returns it with release().
+Wavelengths are sent separately and only when they change.
+
+With shared=True, the slots are allocated in a multiprocessing.shared_memory block that another process can attach
+to by name with FramePool.attach(). In that case free_slots has to be a queue shared by both processes, e.g. a
+multiprocessing.Queue.
+"""
+import queue
+import numpy as np
+
+
+class FramePool:
+    """ n_slots slots of speclength values of type dtype. free_slots holds the indices of the free slots, a queue.Queue
+    by default."""
+
+    def __init__(self, speclength, dtype, n_slots=64, shared=False, free_slots=None, name=None, create=True):
+        self.speclength = speclength
+        self.dtype = np.dtype(dtype)
+        self.n_slots = n_slots
+        self.shared_memory = None
+        self.owner = create  # the creator of a shared pool removes the shared memory on close
+        if shared:
+            from multiprocessing import shared_memory  # only needed for frames shared between processes
+            size = n_slots * speclength * self.dtype.itemsize
+            self.shared_memory = shared_memory.SharedMemory(name=name, create=create, size=size)
+            self.slots = np.ndarray((n_slots, speclength), dtype=self.dtype, buffer=self.shared_memory.buf)
+        else:
+            self.slots = np.zeros((n_slots, speclength), dtype=self.dtype)
+        self.free_slots = queue.Queue() if free_slots is None else free_slots
+        if create:  # all slots are free at the start
+            for idx in range(n_slots):
+                self.free_slots.put(idx)
+
+    @classmethod
+    def attach(cls, name, speclength, dtype, n_slots, free_slots):
+        """ Attaches to the shared pool of another process."""
+        return cls(speclength, dtype, n_slots, shared=True, free_slots=free_slots, name=name, create=False)
+
+    def name(self):
+        return None if self.shared_memory is None else self.shared_memory.name
+
+    def acquire(self, timeout=None):
+        """ Returns the index of a free slot, or None if no slot was released within timeout seconds."""
+        try:
+            return self.free_slots.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def slot(self, idx):
+        return self.slots[idx]
+
+    def release(self, idx):
+        self.free_slots.put(idx)
+
+    def n_free(self):
+        return self.free_slots.qsize()
+
+    def close(self):
+        """ Releases the shared memory of this process, the creator also removes it."""
+        if self.shared_memory is not None:
+            self.slots = None
+            self.shared_memory.close()
+            if self.owner:
+                self.shared_memory.unlink()
+            self.shared_memory = None
@@ -0,0 +1,131 @@
+"""
+Crash-safe journal of the acquired spectra. Next to the temp .h5 file, DataHandling appends every buffer to an
+append-only binary journal before it is queued for the writer thread, and the journal is synced to disk every
+sync_interval seconds. If the program ends without saving, the journal is still there at the next start and
+recover_journal() converts it to an HDF5 file in one streaming pass. At most the spectra of one buffer are lost.
+
+Layout of the journal:
+- header: 8 bytes magic, uint32 length of the description, description as JSON (parameter keys, wavelengths, type and
+  length of the spectra).
+- fixed-size records, one per spectrum: uint64 index, float64 parameters, spectrum in its stored type.
+A record that was only partially written, or whose index does not follow the previous one, ends the journal.
+"""
+import os
+import json
+import time
+import numpy as np
+from DataHandling.SpectraWriter import SpectraWriter
+
+MAGIC = b'SPJOURN1'
+
+
+def record_type(n_parameter, speclength, dtype):
+    """ Type of one record of the journal."""
+    return np.dtype([('index', '<u8'), ('parameters', '<f8', (n_parameter,)), ('spectrum', dtype, (speclength,))])
+
+
+class Journal:
+    """ Append-only journal of one temp file. append() is called from the acquisition thread, sync() may be called from
+    another thread, e.g. the writer thread."""
+
+    def __init__(self, filename, sync_interval=1.):
+        self.filename = filename
+        self.sync_interval = sync_interval
+        self.file = None
+        self.records = None  # preallocated records of one buffer
+        self.n_records = 0
+        self.last_sync = 0
+
+    def create(self, parameter_keys, wavelength, speclength, dtype, chunk_rows=100, description=None):
+        """ Creates a new journal and writes the header. description can hold more JSON-serializable entries."""
+        self.close()
+        header = dict(description or {})
+        header.update({"parameter_keys": list(parameter_keys), "wavelength": np.ravel(wavelength).tolist(),
+                       "speclength": int(speclength), "dtype": np.dtype(dtype).str})
+        header = json.dumps(header).encode()
+        self.records = np.zeros(chunk_rows, dtype=record_type(len(parameter_keys), speclength, dtype))
+        self.n_records = 0
+        self.file = open(self.filename, 'wb', buffering=0)  # unbuffered, every append reaches the OS at once
+        self.file.write(MAGIC + np.uint32(len(header)).tobytes() + header)
+        self.last_sync = time.time()
+
+    def is_open(self):
+        return self.file is not None
+
+    def append(self, parameters, spectra):
+        """ Appends a buffer of parameters (n x n_parameter) and spectra (n x speclength). Returns True if a sync is
+        due, the caller decides in which thread to run sync()."""
+        n = len(spectra)
+        if len(self.records) < n:
+            self.records = np.zeros(n, dtype=self.records.dtype)
+        records = self.records[:n]
+        records['index'] = np.arange(self.n_records, self.n_records + n)
+        records['parameters'] = parameters
+        records['spectrum'] = spectra
+        self.file.write(records.tobytes())
+        self.n_records = self.n_records + n
+        if time.time() - self.last_sync > self.sync_interval:
+            self.last_sync = time.time()
+            return True
+        return False
+
+    def sync(self):
+        """ Forces the journal to disk."""
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+
+def read_header(file):
+    """ Reads the header of an open journal, returns the description and the record type."""
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a journal file')
+    length = int(np.frombuffer(file.read(4), dtype=np.uint32)[0])
+    header = json.loads(file.read(length).decode())
+    dtype = record_type(len(header["parameter_keys"]), header["speclength"], header["dtype"])
+    return header, dtype
+
+
+def recover_journal(journal_filename, destination, chunk_rows=100, compression='gzip'):
+    """ Writes the records of a journal into a new HDF5 file with the layout of DataHandling, streaming chunk_rows
+    records at a time. Returns the number of recovered spectra."""
+    writer = SpectraWriter(chunk_rows, swmr=False)
+    with open(journal_filename, 'rb') as file:
+        header, dtype = read_header(file)
+        spectrum_type = dtype['spectrum'].base
+        attributes = {key: value for key, value in header.items()
+                      if key not in ("parameter_keys", "wavelength", "speclength", "dtype")}
+        attributes["yaxis"] = np.array(header["wavelength"])
+        writer.create(destination,
+                      {"parameters": (len(header["parameter_keys"]), np.float64),
+                       "spectra": (header["speclength"], spectrum_type)},
+                      {"parameters": {"parameter_keys": header["parameter_keys"]}, "spectra": attributes},
+                      compression)
+        n_recovered = 0
+        while True:
+            block = file.read(chunk_rows * dtype.itemsize)
+            records = np.frombuffer(block, dtype=dtype, count=len(block) // dtype.itemsize)
+            # stop at the first record that is not in sequence, e.g. garbage after a crash
+            valid = records['index'] == np.arange(n_recovered, n_recovered + len(records))
+            n_valid = len(records) if valid.all() else int(np.argmin(valid))
+            if n_valid:
+                writer.append({"parameters": records['parameters'][:n_valid],
+                               "spectra": records['spectrum'][:n_valid]})
+            n_recovered = n_recovered + n_valid
+            if n_valid < chunk_rows:
+                break
+    writer.set_file_attribute("comments", "Recovered from " + os.path.basename(journal_filename) + " after a crash")
+    writer.set_file_attribute("recovered", True)
+    writer.close()
+    return n_recovered
@@ -0,0 +1,64 @@
+"""
+Reader for the temp .h5 file while a measurement is running. DataHandling writes the temp file in HDF5
+single-writer/multiple-reader (SWMR) mode, such that a separate analysis process or notebook can follow the acquisition
+without copying the file or stopping the measurement.
+
+Layout of the temp file (C:\\Data\\temp.h5 by default):
+- "spectra": (n_spectra x pixels) dataset, one row per spectrum in the native type of the detector. The x-axis is
+  stored as "yaxis" attribute. If background or transmission corrections are active, "spectra" contains the
+  corrected float32 spectra, the correction is described by its attributes, and the raw spectra are stored as
+  "raw_spectra" if DataHandling.store_raw is set.
+- "parameters": (n_spectra x n_parameter) float64 dataset with the hardware parameters of each spectrum. The column
+  names are stored as "parameter_keys" attribute, the first two are 'time' and 'absolute_time'. With
+  DataHandling.parameter_storage = 'changes', it only contains these two and the other parameters are stored as change
+  log, see ParameterLog.
+Both datasets grow by one chunk of 100 rows at a time and are flushed about every second. Rows of the two datasets
+with the same index belong together. Comments and attributes added during the measurement are only written when the
+data is saved. If DataHandling splits the temp file into shards (shard_spectra, shard_bytes), the spectra are written
+to temp_shard00000.h5, temp_shard00001.h5, ... and the reader has to follow the current shard.
+
+Example:
+    reader = LiveReader(r"C:\\Data\\temp.h5")
+    while True:
+        parameters, spectra = reader.read_new()
+        ...
+        time.sleep(1)
+"""
+import h5py
+
+
+class LiveReader:
+    """ Follows a temp file written by DataHandling. read_new() returns the rows added since its last call."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = h5py.File(filename, 'r', libver='latest', swmr=True)
+        self.spectra = self.file["spectra"]
+        self.parameters = self.file["parameters"]
+        self.wavelength = self.spectra.attrs["yaxis"]
+        self.parameter_keys = list(self.parameters.attrs["parameter_keys"])
+        self.read_idx = 0
+
+    def refresh(self):
+        """ Updates the dataset shapes to the last flush of the writer and returns the number of spectra."""
+        self.parameters.refresh()
+        self.spectra.refresh()
+        # the datasets are flushed one after the other, only rows present in both are complete
+        return min(self.parameters.shape[0], self.spectra.shape[0])
+
+    def read_new(self):
+        """ Returns parameters and spectra of all rows written since the last call."""
+        n_spectra = self.refresh()
+        parameters = self.parameters[self.read_idx:n_spectra]
+        spectra = self.spectra[self.read_idx:n_spectra]
+        self.read_idx = n_spectra
+        return parameters, spectra
+
+    def tail(self, n):
+        """ Returns parameters and spectra of the last n rows."""
+        n_spectra = self.refresh()
+        start = max(n_spectra - n, 0)
+        return self.parameters[start:n_spectra], self.spectra[start:n_spectra]
+
+    def close(self):
+        self.file.close()
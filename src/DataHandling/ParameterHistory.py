@@ -0,0 +1,71 @@
+"""
+History of the hardware parameters. Each call of DataHandling.update_parameter adds one sample of all parameters. The
+history is stored as one columnar NumPy ring buffer (parameter x time) instead of one deque per parameter, such that
+plotting, saving and joining the parameters to the spectra do not require any conversion or copy. Long series are reduced to
+the resolution of the display with minmax_decimate before plotting.
+"""
+import numpy as np
+
+
+class ParameterHistory:
+    """ Ring buffer of the last capacity samples of each parameter. Every sample is written twice, at position idx and
+    idx + capacity. This way, the last n samples of a parameter are always contiguous in memory and can be returned as
+    a view, even after the buffer has wrapped around."""
+
+    def __init__(self, keys, capacity=100000):
+        self.keys = list(keys)
+        self.index = {key: idx for idx, key in enumerate(self.keys)}
+        self.capacity = capacity
+        self.data = np.zeros([len(self.keys), 2 * capacity])
+        self.write_idx = 0  # position of the next sample
+        self.count = 0  # number of valid samples
+        self.n_appended = 0  # number of samples since the last clear, including overwritten ones
+
+    def append(self, values):
+        """ Adds one sample, values contains one value per key."""
+        self.data[:, self.write_idx] = values
+        self.data[:, self.write_idx + self.capacity] = values
+        self.write_idx = (self.write_idx + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.n_appended = self.n_appended + 1
+
+    def view(self):
+        """ Returns a (parameter x time) view on all valid samples, from oldest to newest."""
+        stop = self.write_idx + self.capacity
+        return self.data[:, stop - self.count:stop]
+
+    def series(self, key):
+        """ Returns a contiguous view on all valid samples of one parameter."""
+        return self.view()[self.index[key]]
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.write_idx = 0
+        self.count = 0
+        self.n_appended = 0
+
+
+def minmax_decimate(x, y, n_points):
+    """ Reduces a series to about n_points points for display. The series is split into n_points / 2 buckets and the
+    minimum and maximum of each bucket are kept in their original order, such that peaks and glitches stay visible.
+    The newest sample is always kept. Series that are short enough are returned unchanged."""
+    n_samples = len(y)
+    n_buckets = max(n_points // 2, 1)
+    if n_samples <= n_points:
+        return x, y
+    bucket = -(-n_samples // n_buckets)  # ceil division
+    n_full = n_samples // bucket
+    blocks = y[:n_full * bucket].reshape(n_full, bucket)
+    offsets = np.arange(n_full) * bucket
+    idx_min = np.argmin(blocks, axis=1) + offsets
+    idx_max = np.argmax(blocks, axis=1) + offsets
+    idx = np.c_[np.minimum(idx_min, idx_max), np.maximum(idx_min, idx_max)].ravel()
+    if n_full * bucket < n_samples:  # incomplete last bucket
+        rest = y[n_full * bucket:]
+        idx_rest = np.sort([np.argmin(rest), np.argmax(rest)]) + n_full * bucket
+        idx = np.r_[idx, idx_rest]
+    if idx[-1] != n_samples - 1:  # the newest sample is always shown, new samples are appended to it
+        idx = np.r_[idx, n_samples - 1]
+    return x[idx], y[idx]
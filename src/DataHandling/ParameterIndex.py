@@ -0,0 +1,77 @@
+"""
+Index of the parameter values of a saved run. Finding the spectra that match a condition on the parameters otherwise
+requires reading the whole parameter table. The index is written into the group "index" of the file when the data is
+saved. For each parameter it contains the values in sorted order together with the row of each value, and every
+block_size-th sorted value as fence, such that a range of values is found by bisection on the fences and reading
+only the few blocks of the index at its borders. Matching rows are returned as ranges aligned to the chunks of the
+spectra dataset, which are the units HDF5 reads anyway.
+
+Example:
+    with h5py.File('C:/Data/test_12_00_00.h5', 'r') as hf:
+        rows = query_index(hf["index"], {'set_T': (10, 12), 'central_wave': 600})
+        ranges = chunk_ranges(rows, hf["index"].attrs["chunk_rows"], hf["spectra"].shape[0])
+"""
+import numpy as np
+from DataHandling.ParameterLog import read_parameters, parameter_keys
+
+
+def write_index(file, chunk_rows=100, block_size=1024):
+    """ Builds the index of the "parameters" dataset of an open h5py file and stores it in the group "index"."""
+    parameters = read_parameters(file)
+    keys = parameter_keys(file)
+    if "index" in file:
+        del file["index"]
+    group = file.create_group("index")
+    group.attrs["chunk_rows"] = chunk_rows
+    group.attrs["block_size"] = block_size
+    group.attrs["n_rows"] = parameters.shape[0]
+    for column, key in enumerate(keys):
+        order = np.argsort(parameters[:, column], kind='stable')
+        values = parameters[order, column]
+        key_group = group.create_group(key)
+        key_group.create_dataset("values", data=values, chunks=(block_size,) if len(values) > block_size else None)
+        key_group.create_dataset("rows", data=order)
+        key_group.create_dataset("fences", data=values[::block_size])
+
+
+def value_range(key_group, low, high, block_size):
+    """ Returns the positions start, stop of the sorted values with low <= value <= high."""
+    fences = key_group["fences"][:]
+    values = key_group["values"]
+    positions = []
+    for bound, side in ((low, 'left'), (high, 'right')):
+        # the position lies within the block before the first fence above the bound
+        block = max(np.searchsorted(fences, bound, side=side) - 1, 0)
+        start = block * block_size
+        block_values = values[start:start + 2 * block_size]
+        positions.append(start + int(np.searchsorted(block_values, bound, side=side)))
+    return positions
+
+
+def query_index(group, condition):
+    """ Returns the sorted rows that match condition, a dict of key: value or key: (min, max), using the index group
+    written by write_index. Rows are only read for the matching values."""
+    block_size = int(group.attrs["block_size"])
+    rows = None
+    for key, value in condition.items():
+        low, high = value if isinstance(value, (tuple, list)) else (value, value)
+        start, stop = value_range(group[key], low, high, block_size)
+        key_rows = np.sort(group[key]["rows"][start:stop]) if stop > start else np.empty(0, dtype=np.int64)
+        rows = key_rows if rows is None else np.intersect1d(rows, key_rows, assume_unique=True)
+        if len(rows) == 0:
+            break
+    if rows is None:
+        return np.arange(int(group.attrs["n_rows"]))
+    return rows
+
+
+def chunk_ranges(rows, chunk_rows, n_rows):
+    """ Returns the list of (start, stop) ranges of whole chunks that contain the given sorted rows. Adjacent chunks are
+    merged into one range."""
+    if len(rows) == 0:
+        return []
+    chunks = np.unique(np.asarray(rows) // chunk_rows)
+    breaks = np.flatnonzero(np.diff(chunks) != 1) + 1
+    starts = np.r_[chunks[0], chunks[breaks]] * chunk_rows
+    stops = np.minimum((np.r_[chunks[breaks - 1], chunks[-1]] + 1) * chunk_rows, n_rows)
+    return list(zip(starts.tolist(), stops.tolist()))
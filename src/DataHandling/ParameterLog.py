@@ -0,0 +1,93 @@
+"""
+Change log of the hardware parameters. Most parameters (grating, set temperature, ...) change rarely, storing the full
+parameter row of every spectrum repeats the same values. With DataHandling.parameter_storage = 'changes', the file
+contains:
+- "parameters": (n_spectra x 2) time and absolute_time of each spectrum.
+- "parameter_changes": (n_changes x 3) rows of spectrum index, column and new value, whenever a parameter differs from
+  the previous spectrum. The names of all columns are stored as "parameter_keys" attribute.
+- "parameter_keyframes": (n_keyframes x 1 + n_parameter) spectrum index and full parameter row every
+  keyframe_interval spectra, such that a part of the run can be reconstructed without the changes before it.
+read_parameters() reconstructs the full (n_spectra x n_parameter) table of both layouts.
+"""
+import numpy as np
+
+
+class ParameterLog:
+    """ Encodes batches of full parameter rows (time, absolute_time, parameters...) into changes and keyframes. The
+    state is kept between batches, reset() starts a new file."""
+
+    def __init__(self, keyframe_interval=1000):
+        self.keyframe_interval = keyframe_interval
+        self.n_rows = 0  # rows encoded since the last reset
+        self.previous = None  # last encoded row
+
+    def reset(self):
+        self.n_rows = 0
+        self.previous = None
+
+    def encode(self, table):
+        """ Returns changes (n_changes x 3) and keyframes (n_keyframes x 1 + n_parameter) of the rows in table."""
+        n = len(table)
+        rows = np.arange(self.n_rows, self.n_rows + n)
+        values = table[:, 2:]
+        if self.previous is None:
+            previous = np.vstack([np.full(values.shape[1], np.nan), values[:-1]])
+        else:
+            previous = np.vstack([self.previous, values[:-1]])
+        changed = (values != previous) & ~(np.isnan(values) & np.isnan(previous))
+        row_idx, column_idx = np.nonzero(changed)
+        changes = np.c_[rows[row_idx], column_idx + 2, values[row_idx, column_idx]]
+        is_keyframe = rows % self.keyframe_interval == 0
+        keyframes = np.c_[rows[is_keyframe], table[is_keyframe]]
+        if n:
+            self.previous = values[-1].copy()
+        self.n_rows = self.n_rows + n
+        return changes, keyframes
+
+
+def reconstruct(times, changes, keyframes, n_parameter, first_row=0):
+    """ Rebuilds the parameter table of the rows first_row ... first_row + len(times) from the time columns, the
+    changes and the keyframes of these rows and before. Values before the first event are NaN."""
+    n = len(times)
+    table = np.full([n, n_parameter], np.nan)
+    table[:, :2] = times
+    rows = np.arange(first_row, first_row + n)
+    for column in range(2, n_parameter):
+        selected = changes[:, 1] == column
+        event_rows = np.r_[keyframes[:, 0], changes[selected, 0]]
+        event_values = np.r_[keyframes[:, column + 1], changes[selected, 2]]
+        if len(event_rows) == 0:
+            continue
+        order = np.argsort(event_rows, kind='stable')
+        event_rows = event_rows[order]
+        idx = np.searchsorted(event_rows, rows, side='right') - 1
+        valid = idx >= 0
+        table[valid, column] = event_values[order][idx[valid]]
+    return table
+
+
+def has_log(file):
+    return "parameter_changes" in file
+
+
+def parameter_keys(file):
+    """ Names of the columns of the full parameter table."""
+    source = file["parameter_changes"] if has_log(file) else file["parameters"]
+    return [str(key) for key in source.attrs["parameter_keys"]]
+
+
+def read_parameters(file, start=0, stop=None):
+    """ Returns rows start to stop of the full parameter table of an open h5py file, for both layouts. Only the changes
+    after the last keyframe before start are used."""
+    if not has_log(file):
+        return file["parameters"][start:stop]
+    times = file["parameters"][start:stop]
+    keyframes = file["parameter_keyframes"][:]
+    changes = file["parameter_changes"][:]
+    n_parameter = len(parameter_keys(file))
+    # events before the last keyframe at or before start are not needed
+    first = keyframes[keyframes[:, 0] <= start, 0]
+    first = first[-1] if len(first) else 0
+    changes = changes[changes[:, 0] >= first]
+    keyframes = keyframes[keyframes[:, 0] >= first]
+    return reconstruct(times, changes, keyframes, n_parameter, start)
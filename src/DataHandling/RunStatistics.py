@@ -0,0 +1,103 @@
+"""
+Running statistics of the stored spectra. DataHandling updates them with every flush batch, such that mean, variance,
+minimum and maximum per pixel as well as mean spectra binned by a parameter (e.g. per minute of the run, or per set
+temperature) are available when the data is saved, without reading the file again. Batches are merged with the
+parallel form of Welford's algorithm, which stays accurate for long runs with a large mean.
+"""
+import numpy as np
+
+
+class BinnedMean:
+    """ Mean spectrum per bin of one parameter. Bins have the given width, with width 0 each distinct value of the
+    parameter is its own bin, suitable for set points."""
+
+    def __init__(self, row_length, width=0.):
+        self.row_length = row_length
+        self.width = width
+        self.bins = {}  # bin value: row index in sums and counts
+        self.sums = np.zeros([16, row_length])
+        self.counts = np.zeros(16, dtype=np.int64)
+
+    def update(self, values, batch):
+        bins = np.floor(values / self.width) * self.width if self.width > 0 else values
+        keys, inverse = np.unique(bins, return_inverse=True)
+        for key in keys:
+            if key not in self.bins:
+                if len(self.bins) == len(self.counts):  # grow storage
+                    self.sums = np.r_[self.sums, np.zeros_like(self.sums)]
+                    self.counts = np.r_[self.counts, np.zeros_like(self.counts)]
+                self.bins[key] = len(self.bins)
+        rows = np.array([self.bins[key] for key in keys])
+        if len(keys) == 1:  # usual case, the whole batch falls into one bin
+            self.sums[rows[0]] += batch.sum(axis=0)
+        else:
+            order = np.argsort(inverse, kind='stable')
+            starts = np.r_[0, np.flatnonzero(np.diff(inverse[order])) + 1]
+            self.sums[rows] += np.add.reduceat(batch[order], starts, axis=0)
+        self.counts[rows] += np.bincount(inverse)
+
+    def result(self):
+        """ Returns bin values, counts and mean spectra, sorted by bin value."""
+        keys = np.array(sorted(self.bins))
+        rows = np.array([self.bins[key] for key in keys], dtype=np.int64)
+        counts = self.counts[rows]
+        return keys, counts, self.sums[rows] / np.maximum(counts, 1)[:, None]
+
+
+class RunStatistics:
+    """ Per-pixel statistics of all spectra since the last reset and binned means for the parameters in bin_widths
+    (key: bin width). bin_widths is kept as reference, changes apply with the next reset."""
+
+    def __init__(self, row_length, parameter_keys, bin_widths=None):
+        self.row_length = row_length
+        self.parameter_keys = list(parameter_keys)
+        self.bin_widths = bin_widths if bin_widths is not None else {}
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = np.zeros(self.row_length)
+        self.m2 = np.zeros(self.row_length)  # sum of squared deviations from the mean
+        self.min = np.full(self.row_length, np.inf)
+        self.max = np.full(self.row_length, -np.inf)
+        self.binned = {key: BinnedMean(self.row_length, width) for key, width in self.bin_widths.items()
+                       if key in self.parameter_keys}
+
+    def update(self, parameters, spectra):
+        """ Adds a batch of spectra (n x row_length) with their parameters (n x n_parameter)."""
+        n = len(spectra)
+        if n == 0:
+            return
+        batch = np.asarray(spectra, dtype=np.float64)
+        batch_mean = batch.mean(axis=0)
+        deviation = batch - batch_mean
+        batch_m2 = np.einsum('ij,ij->j', deviation, deviation)
+        # merge with the previous batches
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean += delta * (n / total)
+        self.m2 += batch_m2 + delta ** 2 * (self.count * n / total)
+        self.count = total
+        np.minimum(self.min, batch.min(axis=0), out=self.min)
+        np.maximum(self.max, batch.max(axis=0), out=self.max)
+        for key, binned in self.binned.items():
+            binned.update(parameters[:, self.parameter_keys.index(key)], batch)
+
+    def variance(self):
+        """ Sample variance per pixel."""
+        return self.m2 / max(self.count - 1, 1)
+
+    def write(self, group):
+        """ Writes the statistics as datasets into an h5py group."""
+        group.attrs["count"] = self.count
+        group.create_dataset("mean", data=self.mean)
+        group.create_dataset("variance", data=self.variance())
+        group.create_dataset("min", data=self.min)
+        group.create_dataset("max", data=self.max)
+        for key, binned in self.binned.items():
+            values, counts, means = binned.result()
+            binned_group = group.create_group("binned/" + key)
+            binned_group.attrs["bin_width"] = binned.width
+            binned_group.create_dataset("bins", data=values)
+            binned_group.create_dataset("counts", data=counts)
+            binned_group.create_dataset("mean", data=means)
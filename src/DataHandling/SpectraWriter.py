@@ -0,0 +1,185 @@
+"""
+Writer for the temp .h5 file of DataHandling. Opening and closing the file for every buffer dominates the saving cost
+on long runs, so the writer keeps the file open for the whole measurement. Data is stored spectra-major, one row per
+spectrum, the spectra in their native detector type and the parameters in a separate float64 dataset. Chunks hold
+exactly one flush window, such that each buffer is appended as a whole chunk. The compression filter can be chosen per measurement from the presets below,
+compression_benchmark.py in samples/DataHandling reports speed and compression ratio of each of them.
+For long runs, the file can be split into shards of a fixed number of spectra or size. Only the current shard is
+written, when the writer is closed a small file with virtual datasets presents all shards as one continuous file.
+"""
+import os
+import time
+import h5py
+import numpy as np
+from DataHandling.Finalize import write_stitched
+
+# dataset creation options of the available compression presets. Shuffle reorders the bytes of the values such that
+# similar high bytes end up next to each other, which usually improves the ratio on spectra.
+COMPRESSION_PRESETS = {
+    'none': {},
+    'gzip': {'compression': 'gzip', 'compression_opts': 4},
+    'gzip1': {'compression': 'gzip', 'compression_opts': 1},
+    'gzip9': {'compression': 'gzip', 'compression_opts': 9},
+    'lzf': {'compression': 'lzf'},
+    'shuffle+gzip': {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True},
+    'shuffle+gzip1': {'compression': 'gzip', 'compression_opts': 1, 'shuffle': True},
+    'shuffle+lzf': {'compression': 'lzf', 'shuffle': True},
+}
+
+
+class SpectraWriter:
+    """ Persistent writer session. The file is created with create(), rows are appended with append() and the file is
+    only flushed and closed on close(). If rows are appended after closing, the file is reopened in append mode.
+    The file can contain several datasets that grow together, e.g. spectra in the native detector type and the float64
+    parameter table. Each dataset is stored with its own type.
+    With swmr, the file is written in single-writer/multiple-reader mode: other processes can open it with LiveReader
+    while it is written, the datasets are flushed every flush_interval seconds. Attributes can not be changed in this
+    mode, attributes set after the creation are kept and written when the file is closed.
+    With shard_rows or shard_bytes, a new shard file <name>_shard00001.h5, ... is started when the current one is full.
+    Each shard has the complete layout and attributes. On close(), filename is written with virtual datasets of all
+    shards, attributes set after the creation are written to this file."""
+
+    def __init__(self, chunk_rows=100, swmr=True, flush_interval=1.):
+        self.chunk_rows = chunk_rows
+        self.swmr = swmr
+        self.flush_interval = flush_interval
+        self.filename = None
+        self.layout = {}  # row length and type of each dataset
+        self.file = None
+        self.datasets = {}
+        self.pending_attributes = []  # (dataset name or None for the file, name, value) to write when closing
+        self.last_flush = 0
+        self.attributes = None
+        self.compression = 'gzip'
+        self.shard_rows = 0  # rows per shard, 0 without rollover
+        self.shards = []  # files of the shards written up to now
+        self.shard_attributes = []  # attributes written to the stitched file, written again if it is rewritten
+        self.file_path = None  # file that is written, the current shard or filename
+
+    def is_open(self):
+        return self.file is not None
+
+    def create(self, filename, layout, attributes=None, compression='gzip', shard_rows=0, shard_bytes=0):
+        """ Creates a new file with empty, resizable datasets. layout is a dict of dataset name: (row length, type),
+        attributes a dict of dataset name: dict of attributes. compression is the name of one of the
+        COMPRESSION_PRESETS. With shard_rows or shard_bytes (uncompressed size), the file is split into shards of at
+        most this size, rounded to whole chunks."""
+        self.close()
+        self.filename = filename
+        self.layout = layout
+        self.attributes = attributes
+        self.compression = compression
+        self.shards = []
+        self.shard_attributes = []
+        self.shard_rows = shard_rows
+        if shard_bytes:
+            row_bytes = sum([row_length * np.dtype(dtype).itemsize for row_length, dtype in layout.values()])
+            self.shard_rows = min(self.shard_rows or np.inf, shard_bytes // row_bytes)
+        if self.shard_rows:
+            self.shard_rows = int(max(self.shard_rows // self.chunk_rows, 1) * self.chunk_rows)
+            self.create_file(self.shard_name(0))
+        else:
+            self.create_file(filename)
+
+    def shard_name(self, idx):
+        base, extension = os.path.splitext(self.filename)
+        return base + '_shard' + str(idx).zfill(5) + extension
+
+    def create_file(self, path):
+        # creates the file or shard with the layout and attributes of the current measurement
+        self.file_path = path
+        if self.shard_rows:
+            self.shards.append(path)
+        self.file = h5py.File(path, 'w', libver='latest', rdcc_nbytes=self.cache_size())
+        self.datasets = {}
+        for name, (row_length, dtype) in self.layout.items():
+            self.datasets[name] = self.file.create_dataset(name, shape=(0, row_length), maxshape=(None, row_length),
+                                                           chunks=(self.chunk_rows, row_length), dtype=dtype,
+                                                           **COMPRESSION_PRESETS[self.compression])
+        if self.attributes is not None:
+            for name in self.attributes.keys():
+                for attribute_name, value in self.attributes[name].items():
+                    self.datasets[name].attrs[attribute_name] = value
+        if self.swmr:
+            self.file.swmr_mode = True
+
+    def cache_size(self):
+        # the chunk cache holds a few chunks, such that an incomplete chunk is not evicted before it is filled
+        row_bytes = max([row_length * np.dtype(dtype).itemsize for row_length, dtype in self.layout.values()])
+        return 4 * self.chunk_rows * row_bytes
+
+    def open(self, mode='a'):
+        self.file = h5py.File(self.file_path, mode, libver='latest', rdcc_nbytes=self.cache_size())
+        self.datasets = {name: self.file[name] for name in self.layout.keys()}
+        if self.swmr:
+            self.file.swmr_mode = True
+
+    def append(self, rows):
+        """ Appends rows at the end of the datasets. rows is a dict of dataset name: 2D array. Datasets may grow by
+        different numbers of rows, entries that are not datasets of the layout are ignored."""
+        if not self.is_open():
+            self.open()
+        if self.shard_rows:
+            first = next(iter(self.layout))
+            n_rows = self.datasets[first].shape[0]
+            if n_rows and n_rows + len(rows[first]) > self.shard_rows:
+                # roll over to the next shard
+                self.file.close()
+                self.create_file(self.shard_name(len(self.shards)))
+        for name, data in rows.items():
+            if name not in self.datasets:
+                continue
+            dataset = self.datasets[name]
+            n_rows = dataset.shape[0]
+            dataset.resize(n_rows + data.shape[0], axis=0)
+            dataset[n_rows:, :] = data
+        if self.swmr and time.time() - self.last_flush >= self.flush_interval:
+            # make the new rows visible to readers
+            for dataset in self.datasets.values():
+                dataset.flush()
+            self.last_flush = time.time()
+
+    def set_attribute(self, name, value, dataset="spectra"):
+        """ Sets an attribute of a dataset, by default the spectra."""
+        self.pending_attributes.append((dataset, name, value))
+        if not ((self.swmr or self.shards) and self.is_open()):
+            self.write_attributes()
+
+    def set_file_attribute(self, name, value):
+        self.pending_attributes.append((None, name, value))
+        if not ((self.swmr or self.shards) and self.is_open()):
+            self.write_attributes()
+
+    def write_attributes(self):
+        # attributes can not be written in SWMR mode, the file is reopened without it once closed. Attributes of a
+        # sharded file belong to the stitched file, which only exists once the writer is closed.
+        if self.is_open() and not self.shards:
+            hf = self.file
+        else:
+            hf = h5py.File(self.filename, 'a', libver='latest')
+        if self.shards:
+            self.shard_attributes.extend(self.pending_attributes)
+        for dataset, name, value in self.pending_attributes:
+            if dataset is None:
+                hf.attrs[name] = value
+            else:
+                hf[dataset].attrs[name] = value
+        self.pending_attributes = []
+        if hf is not self.file:
+            hf.close()
+
+    def flush(self):
+        if self.is_open():
+            self.file.flush()
+
+    def close(self):
+        if self.is_open():
+            self.file.close()
+            self.file = None
+            self.datasets = {}
+            if self.shards:
+                write_stitched(self.filename, self.shards)
+                self.pending_attributes = self.shard_attributes + self.pending_attributes
+                self.shard_attributes = []
+        if self.pending_attributes:
+            self.write_attributes()
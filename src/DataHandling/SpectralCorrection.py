@@ -0,0 +1,69 @@
+"""
+Correction of spectra before storage: background subtraction and transmission, absorption or absorbance with respect
+to a reference spectrum. Corrections are applied to whole flush batches with in-place float32 arithmetic, the
+reciprocal of the reference is computed once when it is set, such that each batch only needs multiplications.
+"""
+import numpy as np
+
+
+class SpectralCorrection:
+    """ Correction stage of DataHandling. transmission_option is one of 'no_corr', 'transmission', 'absorption' and
+    'absorbance', like in the CSV DataHandling. The settings are fixed with configure() at the start of a measurement
+    and stored as attributes of the corrected spectra."""
+
+    modes = ('no_corr', 'transmission', 'absorption', 'absorbance')
+
+    def __init__(self, speclength):
+        self.speclength = speclength
+        self.background = None  # float32 background, None if no background is subtracted
+        self.transmission_option = 'no_corr'
+        self.inv_reference = np.ones(speclength, dtype=np.float32)
+        self.frame = np.zeros([1, speclength], dtype=np.float32)  # output of apply_one
+
+    def configure(self, background=None, transmission_option='no_corr', reference=None):
+        """ Sets background (or None) and transmission option. Pixels with zero reference give zero."""
+        if transmission_option not in self.modes:
+            print('Unknown transmission option ' + str(transmission_option) + ', no correction applied')
+            transmission_option = 'no_corr'
+        self.transmission_option = transmission_option
+        self.background = None if background is None else np.asarray(background, dtype=np.float32).reshape(-1)
+        if reference is not None:
+            reference = np.asarray(reference, dtype=np.float32).reshape(-1)
+            if self.background is not None:
+                reference = reference - self.background
+            self.inv_reference = np.zeros(self.speclength, dtype=np.float32)
+            np.divide(1., reference, out=self.inv_reference, where=reference != 0)
+
+    def is_active(self):
+        return self.background is not None or self.transmission_option != 'no_corr'
+
+    def attributes(self):
+        """ Description of the correction, stored with the corrected spectra."""
+        attributes = {"correction": self.transmission_option,
+                      "background_subtracted": self.background is not None}
+        if self.background is not None:
+            attributes["background"] = self.background
+        if self.transmission_option != 'no_corr':
+            attributes["inverse_reference"] = self.inv_reference
+        return attributes
+
+    def apply(self, batch, out):
+        """ Corrects batch (n x speclength, any type) into the float32 array out of the same shape."""
+        np.copyto(out, batch, casting='unsafe')
+        if self.background is not None:
+            np.subtract(out, self.background, out=out)
+        if self.transmission_option == 'transmission':
+            np.multiply(out, self.inv_reference, out=out)
+        elif self.transmission_option == 'absorption':
+            np.multiply(out, self.inv_reference, out=out)
+            np.subtract(1., out, out=out)
+        elif self.transmission_option == 'absorbance':
+            np.multiply(out, self.inv_reference, out=out)
+            out[out <= 0] = 0.001
+            np.log10(out, out=out)
+            np.negative(out, out=out)
+        return out
+
+    def apply_one(self, spec):
+        """ Corrects a single spectrum, e.g. for display. The returned array is reused by the next call."""
+        return self.apply(spec.reshape(1, -1), self.frame)[0]
@@ -0,0 +1,53 @@
+"""
+Preallocated storage for spectra that are waiting to be written to disk. DataHandling receives spectra one by one,
+growing arrays with np.c_ copies the whole window on every spectrum. Here, a fixed-capacity 2D array is allocated once
+and spectra are written in place. Filled windows are handed out as views, so saving does not require any copy either.
+"""
+import numpy as np
+
+
+class SpectrumRingBuffer:
+    """ Fixed-capacity 2D ring buffer. Each row holds one spectrum together with its parameters, such that filled
+    windows are C-contiguous and match the spectra-major layout of the temp file. The buffer is divided into n_slots
+    windows of flush_size rows. When a window is filled, it can be retrieved with pending() and released with
+    mark_flushed(). Writing then continues in the next window and wraps around at the end of the array, such that the
+    pending region is always contiguous."""
+
+    def __init__(self, row_length, flush_size=100, n_slots=2, dtype=np.float64):
+        self.row_length = row_length
+        self.flush_size = flush_size
+        self.capacity = flush_size * n_slots
+        self.data = np.zeros([self.capacity, row_length], dtype=dtype)
+        self.write_idx = 0  # next row to be written
+        self.flush_idx = 0  # first row that was not handed out yet
+
+    def next_row(self):
+        """ Returns a view on the next free row, that should be filled in place by the caller."""
+        if self.write_idx == self.capacity:
+            self.write_idx = 0
+            self.flush_idx = 0
+        row = self.data[self.write_idx]
+        self.write_idx = self.write_idx + 1
+        return row
+
+    def append(self, row):
+        """ Copies row into the next free row of the buffer."""
+        self.next_row()[:] = row
+
+    def n_pending(self):
+        return self.write_idx - self.flush_idx
+
+    def is_full(self):
+        """ True if the current window has to be flushed before writing the next row."""
+        return self.n_pending() >= self.flush_size or self.write_idx == self.capacity
+
+    def pending(self):
+        """ Returns a view on all rows that were written since the last flush."""
+        return self.data[self.flush_idx:self.write_idx]
+
+    def mark_flushed(self):
+        self.flush_idx = self.write_idx
+
+    def reset(self):
+        self.write_idx = 0
+        self.flush_idx = 0
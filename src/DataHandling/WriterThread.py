@@ -0,0 +1,101 @@
+"""
+Background writer for DataHandling. Compression and HDF5 I/O of a filled buffer take much longer than receiving a
+spectrum, so they are moved to a dedicated thread. DataHandling hands over filled buffers through a bounded queue and
+returns immediately. All operations on the temp file go through the same queue, such that they are executed in order.
+"""
+import time
+import queue
+from PyQt5 import QtCore
+from DataHandling.SpectraWriter import SpectraWriter
+
+
+class WriterThread(QtCore.QThread):
+    """ Executes the operations of a SpectraWriter in its own thread. The queue is bounded to max_batches buffers, if it
+    is full the behaviour depends on the policy:
+    - 'stall': the caller waits until the writer has caught up, no data is lost.
+    - 'drop': the buffer is discarded and counted in dropped_batches and dropped_spectra, the caller never waits.
+    Observers, e.g. running statistics, see every appended buffer in the writer thread.
+    Buffers are handed over as views, the caller must not overwrite them before they are written. With the ring buffer
+    of DataHandling, this is guaranteed if it has at least max_batches + 2 slots."""
+
+    def __init__(self, chunk_rows=100, max_batches=8, policy='stall', swmr=True):
+        super(WriterThread, self).__init__()
+        self.writer = SpectraWriter(chunk_rows, swmr)
+        self.queue = queue.Queue(maxsize=max_batches)
+        self.policy = policy
+        self.terminate = False
+        self.dropped_batches = 0
+        self.dropped_spectra = 0
+        self.error = None
+        self.observers = []  # functions called with the rows after each append, in the writer thread
+
+    def run(self):
+        while not self.terminate:
+            function, args = self.queue.get()
+            try:
+                if function is None:  # stop request
+                    self.terminate = True
+                else:
+                    function(*args)
+            except Exception as e:
+                # keep the thread alive, the error is reported and stored until the next measurement
+                self.error = e
+                print(time.strftime('%H:%M:%S') + ' Writer error: ' + str(e))
+            finally:
+                self.queue.task_done()
+        self.writer.close()
+
+    def submit(self, function, *args):
+        # control operations are never dropped
+        self.queue.put((function, args))
+
+    def create(self, filename, layout, attributes=None, compression='gzip', shard_rows=0, shard_bytes=0):
+        self.submit(self.writer.create, filename, layout, attributes, compression, shard_rows, shard_bytes)
+
+    def append(self, rows):
+        """ Hands rows (dict of dataset name: array) over to the writer. Returns False if rows were dropped because
+        the queue was full."""
+        if self.policy == 'drop':
+            try:
+                self.queue.put_nowait((self.append_rows, (rows,)))
+            except queue.Full:
+                self.dropped_batches = self.dropped_batches + 1
+                n_rows = len(next(iter(rows.values())))
+                self.dropped_spectra = self.dropped_spectra + n_rows
+                print(time.strftime('%H:%M:%S') + ' Writer queue full, ' + str(n_rows) + ' spectra dropped')
+                return False
+        else:
+            self.queue.put((self.append_rows, (rows,)))
+        return True
+
+    def append_rows(self, rows):
+        self.writer.append(rows)
+        for observer in self.observers:
+            observer(rows)
+
+    def set_attribute(self, name, value, dataset="spectra"):
+        self.submit(self.writer.set_attribute, name, value, dataset)
+
+    def set_file_attribute(self, name, value):
+        self.submit(self.writer.set_file_attribute, name, value)
+
+    def close(self):
+        self.submit(self.writer.close)
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def flush(self):
+        """ Barrier, returns once all submitted operations are executed."""
+        self.queue.join()
+
+    def reset_counters(self):
+        self.dropped_batches = 0
+        self.dropped_spectra = 0
+        self.error = None
+
+    def stop(self):
+        """ Writes all pending operations, closes the file and ends the thread."""
+        if self.isRunning():
+            self.submit(None)
+            self.wait()
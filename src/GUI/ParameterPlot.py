@@ -8,6 +8,8 @@ class ParameterPlot(QtWidgets.QMainWindow):
 
     send_idx_change = QtCore.pyqtSignal(int, int)
     send_parameter_filename = QtCore.pyqtSignal(str)
+    send_clear = QtCore.pyqtSignal()
+    send_plot_points = QtCore.pyqtSignal(int)
 
     def __init__(self, parameter_dict, *args, **kwargs):
         super(ParameterPlot, self).__init__(*args, **kwargs)
@@ -57,9 +59,10 @@ class ParameterPlot(QtWidgets.QMainWindow):
                 self.unit_list.append(self.parameter_dict[devices][param]['unit'][1:])
             #print(self.unit_list)
 
-        # set plot counter to clear if too many plots
-        self.plotcounter = 0
-        self.startplot_idx = 0
+        # displayed data, full series are replaced by set_data, new samples appended by append_data
+        self.x_data = np.array([])
+        self.y_data = np.array([])
+        self.curve = self.graphWidget.plot(self.x_data, self.y_data)
 
 
         # plot data: x, y values
@@ -87,19 +90,38 @@ class ParameterPlot(QtWidgets.QMainWindow):
 
     @QtCore.pyqtSlot()
     def clear_plot(self):
-        self.graphWidget.clear()
-        self.startplot_idx = self.plotcounter
+        self.x_data = np.array([])
+        self.y_data = np.array([])
+        self.curve.setData(self.x_data, self.y_data)
+        self.send_clear.emit()
 
     @QtCore.pyqtSlot(np.ndarray, np.ndarray)
     def set_data(self, x_array, y_array):
-        self.graphWidget.clear()
-        self.graphWidget.plot(x_array[self.startplot_idx:],y_array[self.startplot_idx:])
-        self.plotcounter = self.plotcounter + 1
+        # receives the full series, already reduced to the plot resolution by DataHandling
+        self.x_data = x_array
+        self.y_data = y_array
+        self.curve.setData(self.x_data, self.y_data)
         try:
             self.value_label.setText(f'Current: {y_array[-1]:,.1f} ' + self.display_unit)
         except:
             pass
 
+    @QtCore.pyqtSlot(np.ndarray, np.ndarray)
+    def append_data(self, x_array, y_array):
+        # receives only the samples acquired since the last update
+        self.x_data = np.r_[self.x_data, x_array]
+        self.y_data = np.r_[self.y_data, y_array]
+        self.curve.setData(self.x_data, self.y_data)
+        try:
+            self.value_label.setText(f'Current: {y_array[-1]:,.1f} ' + self.display_unit)
+        except:
+            pass
+
+    def resizeEvent(self, event):
+        # DataHandling sends about one point per pixel
+        super(ParameterPlot, self).resizeEvent(event)
+        self.send_plot_points.emit(self.graphWidget.width())
+
     def update_plot(self):
         if self.x_axis_button.currentText() == 'absolute_time':
             self.graphWidget.setAxisItems(axisItems={'bottom': pg.DateAxisItem()})
@@ -30,6 +30,10 @@ class SpectrometerPlot(QtWidgets.QMainWindow):
         # add firstplot for Acquire mode
         self.first_plot = True
 
+        # in replace mode, used by View, each spectrum replaces the last one instead of being added
+        self.replace = False
+        self.replace_plot = None
+
         # create random example data set
         sigma = 40
         mu = 2
@@ -70,6 +74,7 @@ class SpectrometerPlot(QtWidgets.QMainWindow):
     @QtCore.pyqtSlot()
     def clear_plot(self):
         self.graphWidget.clear()
+        self.replace_plot = None
         self.startplot_idx = self.plotcounter
         # restore crosshair
         self.graphWidget.addItem(self.crosshair_v, ignoreBounds=True)
@@ -78,15 +83,26 @@ class SpectrometerPlot(QtWidgets.QMainWindow):
 
     @QtCore.pyqtSlot(np.ndarray, np.ndarray)
     def set_data(self, wls, spec):
+        if self.replace and self.replace_plot is not None:
+            self.replace_plot.setData(wls, spec)
+            return
         #color = list(np.random.choice(range(256), size=3))
-        self.graphWidget.plot(wls, spec, pen=QtGui.QColor.fromRgbF(plt.cm.prism(self.plotcounter)[0],plt.cm.prism(self.plotcounter)[1],
+        plot = self.graphWidget.plot(wls, spec, pen=QtGui.QColor.fromRgbF(plt.cm.prism(self.plotcounter)[0],plt.cm.prism(self.plotcounter)[1],
                                                                    plt.cm.prism(self.plotcounter)[2],plt.cm.prism(self.plotcounter)[3]))
+        if self.replace:
+            self.replace_plot = plot
+            return
         self.plotcounter = self.plotcounter + 1
         if self.plotcounter > 100:
             self.clear_plot()
             print(time.strftime('%H:%M:%S') + ' Too many spectra in live plot, clear display for performance')
             self.plotcounter = 0
 
+    def set_replace(self, replace):
+        # switch between replacing the last spectrum and adding spectra to the plot
+        self.replace = replace
+        self.replace_plot = None
+
     @QtCore.pyqtSlot(np.ndarray, np.ndarray)
     def set_data_preview(self, wls, spec):
         if not self.first_plot:
@@ -12,19 +12,23 @@ set_parameter function (assign set functions)
 import numpy as np
 from PyQt5 import QtCore
 from collections import defaultdict
+import threading
 import time
 
 
 class SpectrometerDemo(QtCore.QThread):
 
     name = 'Spectrometer'
+    dtype = np.float64  # type of the spectra returned by get_intensities, averaging and binning give floats
     
     def __init__(self):
         super(SpectrometerDemo, self).__init__()
 
         # load and initialize  spectrometerWorker
         self.spectrometer = SpectrometerWorker()
-        self.spectrometer.sendSpectrum.connect(self.update_spectrum) # connect where signals of worker go to.
+        # connect where signals of worker go to. The direct connection runs update_spectrum in the worker thread, such
+        # that waiting readers are woken up at once and not only when the main event loop gets to it.
+        self.spectrometer.sendSpectrum.connect(self.update_spectrum, QtCore.Qt.DirectConnection)
         self.spectrometer.start()
         self.wavelength = self.spectrometer.wavelengths # get property from Worker
         self.spec_length = self.spectrometer.spec_length # get property from Worker
@@ -39,7 +43,13 @@ class SpectrometerDemo(QtCore.QThread):
         self.binning = 1
         self.int_time = 500
         self.binned_spec = np.zeros(self.spec_length)
-        self.new_spectrum = False
+        # handoff of spectra from the worker to get_intensities. sequence counts the received spectra, readers wait on
+        # frame_condition for a sequence number above the last one they read. After a parameter change only spectra
+        # with sequence >= fresh_sequence are returned.
+        self.frame_condition = threading.Condition()
+        self.sequence = 0
+        self.read_sequence = 0
+        self.fresh_sequence = 0
 
         # setting up variables, open array
         self.spectrum = np.array([])
@@ -74,9 +84,11 @@ class SpectrometerDemo(QtCore.QThread):
         In devices with workers, a pause of continuous acquisition might be required. """
         if parameter == 'int_time':
             self.parameter_dict['int_time'] = value
-            self.spectrometer.set_int_time(value)
-            self.int_time = value
-            self.new_spectrum = False
+            with self.frame_condition:
+                self.spectrometer.set_int_time(value)
+                self.int_time = value
+                self.fresh_sequence = self.sequence + 1  # spectra in flight were acquired with the old time
+                self.frame_condition.notify_all()  # waiting readers restart their timeout with the new time
         elif parameter == 'binning':
             self.parameter_dict['binning'] = value
             self.binning = int(value)
@@ -86,37 +98,59 @@ class SpectrometerDemo(QtCore.QThread):
 
     def update_spectrum(self, spec, int_time):
         """REQUIRED. This is the slot function for the sendSpectrum pyqt.signal from the worker.
-        It updates the last saved spectrum and changes the self.new_spectrum Boolean to True
-        to allow to emit the treated signal from the spectrometer."""
-        if int_time == self.int_time:  # check if spectrum is acquired with desired int conditions
-            self.spectrum = spec
-            self.new_spectrum = True
+        It updates the last saved spectrum, increases its sequence number and wakes up the readers waiting in
+        get_intensities."""
+        with self.frame_condition:
+            if int_time == self.int_time:  # check if spectrum is acquired with desired int conditions
+                self.spectrum = spec
+                self.sequence = self.sequence + 1
+                self.frame_condition.notify_all()
+
+    def default_timeout(self):
+        # a few integration times
+        return 3 * self.int_time / 1000 + 1
+
+    def wait_spectrum(self, timeout=None):
+        """ Blocks until a spectrum newer than the last one read and acquired with the current settings arrives and
+        returns it. Raises TimeoutError if there is none within timeout seconds, by default a few integration times.
+        The timeout restarts when the integration time is changed during the wait."""
+        with self.frame_condition:
+            settings = self.fresh_sequence
+            wait = self.default_timeout() if timeout is None else timeout
+            deadline = time.monotonic() + wait
+            while not (self.sequence > self.read_sequence and self.sequence >= self.fresh_sequence):
+                if self.fresh_sequence != settings:
+                    settings = self.fresh_sequence
+                    wait = self.default_timeout() if timeout is None else timeout
+                    deadline = time.monotonic() + wait
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('No spectrum from ' + self.name + ' within ' + '{:.1f}'.format(wait) + ' s')
+                self.frame_condition.wait(remaining)
+            self.read_sequence = self.sequence
+            return self.spectrum
 
     def get_wavelength(self):
         """This simply returns the wavelength. In Colbert this needs to be adapted if the calibration
          changes. This function will be accessible from MeasurementClasses. """
         return np.linspace(177.2218, 884.00732139, 2048)
 
-    def get_intensities(self):
+    def get_intensities(self, out=None, timeout=None):
         """ Gets the intensity. The example include the possibility of averaging several spectra and to
         perform a binning. Such functionalities might also be given by the camera.
-        This function will be accessible from MeasurementClasses."""
+        This function will be accessible from MeasurementClasses. If out is given, e.g. a slot of the FramePool of
+        DataHandling, the spectrum is written into it instead of a new array. Each call returns spectra that were not
+        returned before, acquired after the last parameter change. It waits at most timeout seconds per spectrum, by
+        default a few of the current integration times, and raises TimeoutError otherwise."""
         if self.avg_scan == 1:
-            while not self.new_spectrum:
-                time.sleep(0.05)
-            spectrum = self.spectrum
-            self.new_spectrum = False
+            spectrum = self.wait_spectrum(timeout)
         else:
-            spectrum = np.zeros(len(self.spectrum))
+            spectrum = np.zeros(self.spec_length)
             for i in range(self.avg_scan):
-                time.sleep(self.int_time / 1000 + 0.05)
-                while not self.new_spectrum:
-                    time.sleep(0.05)
-                spectrum = spectrum + self.spectrum
-                self.new_spectrum = False
-        return self.do_binning(spectrum)
-
-    def do_binning(self, spectrum):
+                spectrum = spectrum + self.wait_spectrum(timeout)
+        return self.do_binning(spectrum, out)
+
+    def do_binning(self, spectrum, out=None):
         """ Manual binning of the spectra. Some cameras might allow to readout pixel together to increase
         signal-to-noise at the cost of lower resolution. """
         #print(spectrum)
@@ -127,7 +161,7 @@ class SpectrometerDemo(QtCore.QThread):
                 self.binned_spec[i] = np.sum(spectrum[0:i])
             else:
                 self.binned_spec[i] = np.sum(spectrum[i - self.binning + 1:i + self.binning])
-        return self.binned_spec/(2 * (self.binning - 1) + 1)/self.avg_scan
+        return np.divide(self.binned_spec, (2 * (self.binning - 1) + 1) * self.avg_scan, out=out, casting='unsafe')
 
 class SpectrometerWorker(QtCore.QThread):
     """ This is a DemoWorker for the spectrometer.
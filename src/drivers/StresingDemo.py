@@ -19,6 +19,7 @@ import time
 class StresingDemo(QtCore.QThread):
 
     name = 'Stresing Demo'
+    dtype = np.uint16  # type of the pixel values delivered by the camera
 
     def __init__(self):
         super(StresingDemo, self).__init__()
@@ -102,7 +103,8 @@ class StresingWorker(QtCore.QThread):
         time.sleep(self.int_time/1000)
         if time.time()-t1 >0.1:
             time.sleep(0.1)
-        return flatspec.reshape(-1)
+        # the camera delivers unsigned 16 bit counts
+        return np.clip(flatspec.reshape(-1), 0, 65535).astype(np.uint16)
 
     def set_int_time(self, int_time):
         self.int_time = int_time
\ No newline at end of file
@@ -8,6 +8,7 @@ Created on Wed Jun  5 10:52:39 2024
 from ctypes import *
 from pathlib import Path
 import configparser
+import numpy as np
 
 class camera_settings(Structure):
 	_fields_ = [("use_software_polling", c_uint32),
@@ -69,6 +70,8 @@ class measurement_settings(Structure):
     
 class stresing:
 
+    dtype = np.uint16  # type of the pixel values, frames are returned as lists of uint16_t
+
     def __init__(self, path_config, path_camera_dll):
         
         # Create a ConfigParser object
@@ -21,6 +21,7 @@ from drivers.SLMDemo import SLMDemo
 from drivers.StresingDemo import StresingDemo
 from drivers.MonochromDemo import MonochromDemo
 from DataHandling.DataHandling import DataHandling
+from measurements.RateController import RateController
 from measurements.MeasurementClasses import AcquireMeasurement,RunMeasurement,BackgroundMeasurement, \
     ViewMeasurement, KineticMeasurement
 
@@ -68,6 +69,10 @@ class MainInterface(QtWidgets.QMainWindow):
         self.devices['Monochrom'] = self.Monochrom 
         print('Monochrom DEMO connected')
 
+        # rate control of continuous measurements, its rates are shown and stored like device parameters
+        self.rate_controller = RateController()
+        self.devices['acquisition'] = self.rate_controller
+
         # find items to complement in GUI
         self.parameter_tree = self.findChild(QtWidgets.QTreeWidget, 'parameters_treeWidget')
         self.spectro_tab = self.findChild(QtWidgets.QWidget, 'spectro_tab')
@@ -148,10 +153,12 @@ class MainInterface(QtWidgets.QMainWindow):
                 self.parameter_tree.setItemWidget(child, 1, self.parameter_widgets[param])
 
         # start DataHandling
-        self.DataHandling = DataHandling(self.parameter, self.spec_length)
+        self.DataHandling = DataHandling(self.parameter, self.spec_length, self.spectrometer.dtype)
         self.DataHandling.sendParameterarray.connect(self.ParameterPlot.set_data)
+        self.DataHandling.sendParameterTail.connect(self.ParameterPlot.append_data)
         self.DataHandling.sendSpectrum.connect(self.SpectrometerPlot.set_data)
         self.DataHandling.sendMaximum.connect(self.SpectrometerPlot.update_datareader)
+        self.rate_controller.backlog = self.DataHandling.backlog
 
         # start Updater to update device read parameters
         self.Updater = UpdateWorker(self.devices, self.readonly_parameter)
@@ -160,6 +167,12 @@ class MainInterface(QtWidgets.QMainWindow):
 
         # set variables
         self.measurement_busy = False
+        # handling of kinetic steps that are reached late: 'catch_up', 'skip' or 'shift' the rest of the timeline
+        self.kinetic_late_policy = 'catch_up'
+        # RunMeasurement acquires the next spectrum while the last one is sent
+        self.run_pipelined = True
+        # reduction of the background scans, 'mean', 'median' or 'sigma_clip'
+        self.bg_reducer = 'mean'
         self.save_folder_path = r'C:/Data/test'
         #a default data folder is always required and it would be good to keep it seperated from the code.
         #can everyone simply create a C:/Data/test' path on their device? # Not sure how to handle different OS here.
@@ -179,6 +192,8 @@ class MainInterface(QtWidgets.QMainWindow):
         self.bg_check_box.stateChanged.connect(self.update_check_bg)
         self.ParameterPlot.send_idx_change.connect(self.DataHandling.change_send_idx)
         self.ParameterPlot.send_parameter_filename.connect(self.DataHandling.save_parameter)
+        self.ParameterPlot.send_clear.connect(self.DataHandling.set_plot_start)
+        self.ParameterPlot.send_plot_points.connect(self.DataHandling.set_plot_points)
         self.kinetic_lineEdit.editingFinished.connect(self.change_kinetic_interval)
         self.kinetic_run_button.clicked.connect(self.kinetic_measurement)
 
@@ -224,11 +239,16 @@ class MainInterface(QtWidgets.QMainWindow):
         # test function to test anything
         print('I am testing')
 
+    def set_duty_cycle(self, duty_cycle):
+        # fraction of the time the detector is read, low values mean acquisition waits for data handling
+        self.statusBar().showMessage('Duty cycle ' + '{:.0f}'.format(duty_cycle * 100) + ' %')
+
     def set_progress(self, progress):
         # set progress bar and define whether a measurement is running. When progess ne 100, no new measurement starts
         self.progress_bar.setValue(int(progress))
         if progress == 100.:
             self.measurement_busy = False
+            self.SpectrometerPlot.set_replace(False)
 
     def change_folder(self):
         # select folder to save data
@@ -249,8 +269,14 @@ class MainInterface(QtWidgets.QMainWindow):
         # open background file and set as background
         BackgroundFile = QtWidgets.QFileDialog.getOpenFileName(self, 'Select background data')
         bg_path = BackgroundFile[0]
-        bg = np.loadtxt(bg_path, delimiter=',')
-        self.DataHandling.background = bg[-self.spec_length:, 1]
+        if bg_path.endswith('.h5'):
+            # background saved by DataHandling, the last spectrum is the averaged one
+            run = self.DataHandling.load_data(bg_path)
+            self.DataHandling.set_background(run.spectrum(-1))
+            run.close()
+        else:
+            bg = np.loadtxt(bg_path, delimiter=',')
+            self.DataHandling.set_background(bg[-self.spec_length:, 1])
         # print(np.shape(bg[1:,1]))
 
         # display background filename
@@ -258,7 +284,7 @@ class MainInterface(QtWidgets.QMainWindow):
         self.bg_file_indicator.setText(bg_path[idx+1:])
 
     def update_check_bg(self):
-        self.DataHandling.correct_background = self.bg_check_box.isChecked()
+        self.DataHandling.set_correct_background(self.bg_check_box.isChecked())
 
     def change_kinetic_interval(self):
         # generate timing array for time resolved measurement
@@ -307,10 +333,12 @@ class MainInterface(QtWidgets.QMainWindow):
         if not self.measurement_busy:
             self.measurement_busy = True
             self.DataHandling.clear_data()
+            # the plot shows only the latest of the spectra forwarded at the display rate
+            self.SpectrometerPlot.clear_plot()
+            self.SpectrometerPlot.set_replace(True)
             self.measurement = ViewMeasurement(self.devices, self.parameter)
             self.measurement.sendProgress.connect(self.set_progress)
             self.measurement.sendSpectrum.connect(self.DataHandling.concatenate_data)
-            self.measurement.sendClear.connect(self.SpectrometerPlot.clear_plot)
             self.measurement.start()
         else:
             print('Measurement not started, devices are busy')
@@ -320,9 +348,12 @@ class MainInterface(QtWidgets.QMainWindow):
         if not self.measurement_busy:
             self.measurement_busy = True
             self.DataHandling.clear_data()
-            self.measurement = RunMeasurement(self.devices, self.parameter)
+            self.measurement = RunMeasurement(self.devices, self.parameter, self.DataHandling.frame_pool,
+                                              self.run_pipelined)
             self.measurement.sendProgress.connect(self.set_progress)
-            self.measurement.sendSpectrum.connect(self.DataHandling.concatenate_data)
+            self.measurement.sendDutyCycle.connect(self.set_duty_cycle)
+            self.measurement.sendWavelength.connect(self.DataHandling.set_wavelength)
+            self.measurement.sendFrame.connect(self.DataHandling.receive_frame)
             self.measurement.start()
         else:
             print('Measurement not started, devices are busy')
@@ -331,11 +362,12 @@ class MainInterface(QtWidgets.QMainWindow):
         # acquire background to subtract from spectra. May average over several spectra
         if not self.measurement_busy:
             self.measurement_busy = True
-            self.DataHandling.clear_data()
+            self.DataHandling.clear_data(store_dtype=np.float32, correct=False)  # averaged, uncorrected
             self.measurement = BackgroundMeasurement(self.devices, self.parameter, self.bg_scans_box.value(),
-                                                     self.filename, self.comments_edit.toPlainText())
+                                                     self.filename, self.comments_edit.toPlainText(), self.bg_reducer)
             self.measurement.sendProgress.connect(self.set_progress)
             self.measurement.sendSpectrum.connect(self.DataHandling.concatenate_data)
+            self.measurement.sendDataset.connect(self.DataHandling.add_dataset)
             self.measurement.sendSave.connect(self.DataHandling.save_data)
             self.measurement.start()
         else:
@@ -348,10 +380,12 @@ class MainInterface(QtWidgets.QMainWindow):
             #self.DataPlot.clear_data()
             self.DataHandling.clear_data()
             self.change_kinetic_interval()
-            self.measurement =KineticMeasurement(self.devices, self.parameter, self.kinetic_interval)
+            self.measurement =KineticMeasurement(self.devices, self.parameter, self.kinetic_interval,
+                                                 self.kinetic_late_policy)
             self.measurement.sendProgress.connect(self.set_progress)
             self.measurement.sendSpectrum.connect(self.DataHandling.concatenate_data)
             self.measurement.sendParameter.connect(self.change_parameter)
+            self.measurement.sendTimeline.connect(self.DataHandling.set_timeline)
             self.measurement.start()
         else:
             print('Measurement not started, devices are busy')
@@ -387,4 +421,5 @@ class UpdateWorker(QtCore.QThread):
 
 app = QtWidgets.QApplication(sys.argv)
 window = MainInterface()
+app.aboutToQuit.connect(window.DataHandling.close)  # write pending spectra, close temp file and remove journal
 app.exec_()
@@ -7,8 +7,13 @@ until the measurement has finished.
 
 import time
 import re
+import inspect
 from PyQt5 import QtCore
 import numpy as np
+from measurements.Timeline import TimelineScheduler
+from measurements.Pipeline import AcquisitionPipeline
+from DataHandling.FramePool import FramePool
+from DataHandling.BackgroundReduction import reduce_scans
 
 
 # Measurement to acquire one spectrum
@@ -34,7 +39,11 @@ class AcquireMeasurement(QtCore.QThread):
             self.sendProgress.emit(100)
 
     def take_spectrum(self):
-        self.spec = np.array(self.spectrometer.get_intensities())
+        try:
+            self.spec = np.asarray(self.spectrometer.get_intensities(), dtype=self.spectrometer.dtype)
+        except TimeoutError as e:
+            print(time.strftime('%H:%M:%S') + ' ' + str(e))
+            return
         self.sendSpectrum.emit(self.wls, self.spec)
 
     def stop(self):
@@ -47,29 +56,38 @@ class ViewMeasurement(QtCore.QThread):
     # set used signal types, destination is set in main script
     sendSpectrum = QtCore.pyqtSignal(np.ndarray, np.ndarray)
     sendProgress = QtCore.pyqtSignal(float)
-    sendClear = QtCore.pyqtSignal()
 
     def __init__(self, devices, parameter):
         super(ViewMeasurement, self).__init__()
         self.spectrometer = devices['spectrometer']
+        self.rate_controller = devices.get('acquisition')  # throttles only if the consumers fall behind
         self.wls = []  # preallocate wls array
         self.spec = []  # preallocate spec array
         self.terminate = False
 
     def run(self):
+        if self.rate_controller is not None:
+            self.rate_controller.start()
         while not self.terminate:  # check whether stopping measurement is called
             t = time.time()
             self.sendProgress.emit(50)
             self.wls = np.array(self.spectrometer.get_wavelength())
-            self.spec = np.array(self.spectrometer.get_intensities())
-            self.sendClear.emit()
+            try:
+                self.spec = np.asarray(self.spectrometer.get_intensities(), dtype=self.spectrometer.dtype)
+            except TimeoutError as e:  # e.g. settings changed, try again
+                print(time.strftime('%H:%M:%S') + ' ' + str(e))
+                continue
             self.sendSpectrum.emit(self.wls, self.spec)
 
             # limit too fast acquistion for computation
-            if time.time() - t < 0.02:
+            if self.rate_controller is not None:
+                self.rate_controller.pace()
+            elif time.time() - t < 0.02:
                 time.sleep(0.02)
 
         # Finish measurement when loop is terminated
+        if self.rate_controller is not None:
+            self.rate_controller.stop()
         print(time.strftime('%H:%M:%S') + ' Finished')
         self.sendProgress.emit(100)
 
@@ -80,35 +98,149 @@ class ViewMeasurement(QtCore.QThread):
 
 # Measurement to continuously acquire spectra and concatenate in DataHandling
 class RunMeasurement(QtCore.QThread):
-    # set used signal types, destination is set in main script
+    # set used signal types, destination is set in main script. With a frame pool, spectra are written into its
+    # slots and sent as slot index with sendFrame, wavelengths are only sent with sendWavelength when they change.
+    # sendDutyCycle reports the fraction of the last second spent waiting for the detector.
     sendSpectrum = QtCore.pyqtSignal(np.ndarray, np.ndarray)
+    sendFrame = QtCore.pyqtSignal(int)
+    sendWavelength = QtCore.pyqtSignal(np.ndarray)
     sendProgress = QtCore.pyqtSignal(float)
+    sendDutyCycle = QtCore.pyqtSignal(float)
 
-    def __init__(self, devices, parameter):
+    def __init__(self, devices, parameter, frame_pool=None, pipelined=False, n_buffers=2):
         super(RunMeasurement, self).__init__()
         self.spectrometer = devices['spectrometer']
+        self.rate_controller = devices.get('acquisition')  # throttles only if the consumers fall behind
+        self.frame_pool = frame_pool
+        # drivers that accept out fill the slot directly
+        self.fill_in_place = 'out' in inspect.signature(self.spectrometer.get_intensities).parameters
+        # in pipelined mode the next spectrum is acquired while the last one is sent. Without frame pool, n_buffers
+        # slots are used for this.
+        self.pipelined = pipelined
+        self.n_buffers = max(n_buffers, 2)
         self.wls = []  # preallocate wls array
         self.spec = []  # preallocate spec array
         self.terminate = False
+        self.start_ns = 0
+        self.integration_ns = 0  # time spent in get_intensities
+        self.report_ns = 0
+        self.report_integration_ns = 0
         print('emit start time ')
 
     def run(self):
+        self.start_ns = time.perf_counter_ns()
+        self.report_ns = self.start_ns
+        self.integration_ns = 0
+        self.report_integration_ns = 0
+        if self.rate_controller is not None:
+            self.rate_controller.start()
+        if self.pipelined:
+            self.run_pipelined()
+        else:
+            self.run_sequential()
+        if self.rate_controller is not None:
+            self.rate_controller.stop()
+        print(time.strftime('%H:%M:%S') + ' Finished, duty cycle ' +
+              '{:.1f}'.format(100 * self.integration_ns / max(time.perf_counter_ns() - self.start_ns, 1)) + ' %')
+        self.sendProgress.emit(100)
+        return
+
+    def run_sequential(self):
+        # acquire, send and throttle one spectrum after the other
         while not self.terminate:  # loop runs until requested stop
             t1 = time.time()
-            self.wls = np.array(self.spectrometer.get_wavelength())
-            self.spec = np.array(self.spectrometer.get_intensities())
-
-            # send data
-            self.sendSpectrum.emit(self.wls, self.spec)
+            if self.frame_pool is None:
+                self.wls = np.array(self.spectrometer.get_wavelength())
+                t_int = time.perf_counter_ns()
+                try:
+                    self.spec = np.asarray(self.spectrometer.get_intensities(), dtype=self.spectrometer.dtype)
+                except TimeoutError as e:  # e.g. settings changed, try again
+                    print(time.strftime('%H:%M:%S') + ' ' + str(e))
+                    continue
+                self.integration_ns = self.integration_ns + time.perf_counter_ns() - t_int
+
+                # send data
+                self.sendSpectrum.emit(self.wls, self.spec)
+            elif not self.send_frame():
+                continue
             progress = 50
             self.sendProgress.emit(progress)
+            self.report_duty_cycle(self.integration_ns)
 
             # limit too fast acquistion for computation
-            if time.time() - t1 < 0.02:
+            if self.rate_controller is not None:
+                self.rate_controller.pace()
+            elif time.time() - t1 < 0.02:
                 time.sleep(0.02)
-        print(time.strftime('%H:%M:%S') + ' Finished')
-        self.sendProgress.emit(100)
-        return
+
+    def run_pipelined(self):
+        # acquisition runs in the pipeline thread, this thread sends the acquired slots. There is no fixed throttle,
+        # acquisition stalls when all slots wait to be processed, e.g. while the rate controller holds this thread.
+        pool = self.frame_pool
+        if pool is None:
+            pool = FramePool(self.spectrometer.spec_length, self.spectrometer.dtype, n_slots=self.n_buffers)
+        pipeline = AcquisitionPipeline(self.spectrometer, pool, self.fill_in_place)
+        pipeline.start()
+        self.sendProgress.emit(50)
+        while pipeline.is_running():
+            if self.terminate and pipeline.running:
+                pipeline.stop()  # the slots acquired before are still sent
+            idx = pipeline.get(timeout=0.1)
+            if idx is None:
+                continue
+            self.update_wavelength()
+            if self.frame_pool is None:
+                self.spec = np.array(pool.slot(idx))
+                pool.release(idx)
+                self.sendSpectrum.emit(self.wls, self.spec)
+            else:
+                self.sendFrame.emit(idx)
+            self.report_duty_cycle(pipeline.integration_ns)
+            if self.rate_controller is not None and not self.terminate:  # after Stop the rest is sent at once
+                self.rate_controller.pace()
+        pipeline.stop()
+        self.integration_ns = pipeline.integration_ns
+        if pipeline.n_stalls:
+            print(time.strftime('%H:%M:%S') + ' Acquisition waited ' + str(pipeline.n_stalls) +
+                  ' times for a free slot')
+
+    def update_wavelength(self):
+        # wavelengths are sent with sendWavelength only when they change, with every spectrum by sendSpectrum
+        wls = self.spectrometer.get_wavelength()
+        if not np.array_equal(wls, self.wls):
+            self.wls = np.array(wls)
+            if self.frame_pool is not None:
+                self.sendWavelength.emit(self.wls)
+
+    def report_duty_cycle(self, integration_ns):
+        # emits the duty cycle of the last second
+        now = time.perf_counter_ns()
+        if now - self.report_ns >= 1e9:
+            self.sendDutyCycle.emit((integration_ns - self.report_integration_ns) / (now - self.report_ns))
+            self.report_ns = now
+            self.report_integration_ns = integration_ns
+
+    def send_frame(self):
+        # acquire into a free slot of the frame pool and send its index, returns whether a frame was sent
+        self.update_wavelength()
+        idx = self.frame_pool.acquire(timeout=1.)
+        if idx is None:
+            print(time.strftime('%H:%M:%S') + ' No free frame slot, DataHandling does not keep up')
+            return False
+        slot = self.frame_pool.slot(idx)
+        t_int = time.perf_counter_ns()
+        try:
+            if self.fill_in_place:
+                self.spectrometer.get_intensities(out=slot)
+            else:
+                slot[:] = self.spectrometer.get_intensities()
+        except TimeoutError as e:
+            self.frame_pool.release(idx)
+            print(time.strftime('%H:%M:%S') + ' ' + str(e))
+            return False
+        self.integration_ns = self.integration_ns + time.perf_counter_ns() - t_int
+        self.sendFrame.emit(idx)
+        return True
 
     #  initiate controlled stop by enableing terminate statement, that is frequently queried in run code
     def stop(self):
@@ -117,18 +249,24 @@ class RunMeasurement(QtCore.QThread):
 
 
 class BackgroundMeasurement(QtCore.QThread):
-    # set used signal types, destination is set in main script
+    # set used signal types, destination is set in main script. The noise of the background is sent with
+    # sendDataset before it is saved.
     sendSpectrum = QtCore.pyqtSignal(np.ndarray, np.ndarray)
+    sendDataset = QtCore.pyqtSignal(str, np.ndarray, dict)
     sendProgress = QtCore.pyqtSignal(float)
     sendSave = QtCore.pyqtSignal(str, str)
 
-    def __init__(self, devices, parameter, scans, filename, comments):
+    def __init__(self, devices, parameter, scans, filename, comments, reducer='mean', clip_sigma=3.):
         super(BackgroundMeasurement, self).__init__()
         self.spectrometer = devices['spectrometer']
+        self.fill_in_place = 'out' in inspect.signature(self.spectrometer.get_intensities).parameters
         self.wls = []  # preallocate wls array
         self.spec = []  # preallocate spec array
-        self.summedspec = []
-        self.scans = scans
+        self.scans = max(int(scans), 1)
+        # scans are collected in one block and reduced with 'mean', 'median' or 'sigma_clip', see BackgroundReduction
+        self.block = np.zeros([self.scans, self.spectrometer.spec_length])
+        self.reducer = reducer
+        self.clip_sigma = clip_sigma
         self.filename = filename[:filename.rfind('/') + 1] + 'Background'
         print(filename[:filename.rfind('/') + 1] + 'Background')
         self.comments = comments
@@ -136,17 +274,25 @@ class BackgroundMeasurement(QtCore.QThread):
 
     def run(self):
         if not self.terminate:  # check whether stopping measurement is called
-            self.summedspec = np.array(self.spectrometer.get_intensities())
-            for i in range(self.scans - 1):
+            self.wls = np.array(self.spectrometer.get_wavelength())
+            for i in range(self.scans):
+                try:
+                    if self.fill_in_place:
+                        self.spectrometer.get_intensities(out=self.block[i])
+                    else:
+                        self.block[i] = self.spectrometer.get_intensities()
+                except TimeoutError as e:
+                    print(time.strftime('%H:%M:%S') + ' ' + str(e) + ', background not acquired')
+                    self.sendProgress.emit(100)
+                    return
                 self.sendProgress.emit((i + 1) / self.scans * 100)
-                self.wls = np.array(self.spectrometer.get_wavelength())
-                self.spec = np.array(self.spectrometer.get_intensities())
-                self.summedspec = self.summedspec + self.spec
-            self.spec = self.summedspec / self.scans
+            self.spec, noise, rejected = reduce_scans(self.block, self.reducer, self.clip_sigma)
             self.sendSpectrum.emit(self.wls, self.spec)
+            self.sendDataset.emit("noise", noise, {'reducer': self.reducer, 'scans': self.scans,
+                                                   'clip_sigma': self.clip_sigma, 'rejected': rejected})
             self.sendSave.emit(self.filename, self.comments)
             self.sendProgress.emit(100)
-            print(time.strftime('%H:%M:%S') + 'Background acquired')
+            print(time.strftime('%H:%M:%S') + 'Background acquired, ' + str(rejected) + ' values rejected')
 
     def stop(self):
         self.terminate = True
@@ -158,8 +304,9 @@ class KineticMeasurement(QtCore.QThread):
     sendProgress = QtCore.pyqtSignal(float)
     sendParameter = QtCore.pyqtSignal(str, float)
     sendSpectrum = QtCore.pyqtSignal(np.ndarray, np.ndarray)
+    sendTimeline = QtCore.pyqtSignal(np.ndarray, dict)
 
-    def __init__(self, devices, parameter, kinetic_interval):
+    def __init__(self, devices, parameter, kinetic_interval, late_policy='catch_up', late_tolerance=0.001):
         super(KineticMeasurement, self).__init__()
         self.Spectrometer = devices['spectrometer']
         #self.orpheus = devices['thorlabs_shutter']
@@ -169,6 +316,8 @@ class KineticMeasurement(QtCore.QThread):
         self.terminate = False
         self.t_curr_step = 0
         self.t0 = 0
+        # steps are scheduled on a perf_counter timeline, late steps are handled according to late_policy
+        self.timeline = TimelineScheduler(late_policy, late_tolerance)
         try:  # extract max time of measurement series to calculate progress
             self.max_time = float(re.findall('[0-9]+[.]', kinetic_interval[-1])[0])
         except:
@@ -182,7 +331,8 @@ class KineticMeasurement(QtCore.QThread):
         if not self.terminate:
             # get wls and start time
             self.wls = np.array(self.Spectrometer.get_wavelength())
-            self.t0 = time.time()
+            self.timeline.start()
+            self.t0 = self.timeline.t0_absolute
 
             # get commands from kinetic_interval
             for k in self.kinetic_interval:
@@ -200,39 +350,41 @@ class KineticMeasurement(QtCore.QThread):
                             wait = 0.05
                             time.sleep(wait)
 
-                        # open, acquire, close and wait
+                        # wait, then open, acquire and close
                         elif k[0] == 'p':
                             # set spectrometer in probe trigger mode
                             self.Spectrometer.probe_trigger = True
                             self.t_curr_step = float(k[1:])
-                            # wait
-                            wait_time = self.t0 + float(k[1:]) - time.time()
-                            if wait_time > 0:
-                                time.sleep(wait_time)
-                            else:
-                                print('Waiting time before probe cycle negative:' + str(wait_time))
-                            self.probe_cycle()
+                            if self.timeline.wait_until(self.t_curr_step):
+                                self.probe_cycle()
                             self.sendProgress.emit(float(k[1:]) / self.max_time * 100)
 
-                    # acquire spectrum and wait
+                    # wait and acquire spectrum
                     elif isinstance(k, np.ndarray):  # waiting command
                         for j in k:
                             if not self.terminate:
                                 self.t_curr_step = j
-                                self.spec = np.array(self.Spectrometer.get_intensities())
-                                self.sendSpectrum.emit(self.wls, self.spec)
+                                if self.timeline.wait_until(j):
+                                    self.timeline.begin_step()
+                                    try:
+                                        self.spec = np.asarray(self.Spectrometer.get_intensities(),
+                                                               dtype=self.Spectrometer.dtype)
+                                    except TimeoutError as e:
+                                        print(time.strftime('%H:%M:%S') + ' ' + str(e))
+                                        self.timeline.fail_step()
+                                    else:
+                                        self.timeline.end_step()
+                                        self.sendSpectrum.emit(self.wls, self.spec)
                                 self.sendProgress.emit(j / self.max_time * 100)
-                                t3 = time.time()
-                                wait_time = self.t0 + self.t_curr_step - t3
-
-                                if wait_time > 0:
-                                    time.sleep(wait_time)
-                                else:
-                                    print('Waiting time negative:' + str(wait_time))
 
                     else:
                         print('Unknown instance in kinetic interval')
 
+        if self.timeline.current is not None:  # stopped during a probe cycle, the step is not complete
+            self.timeline.fail_step()
+        self.sendTimeline.emit(self.timeline.timeline(), {'columns': self.timeline.columns, 't0': self.t0,
+                                                          'late_policy': self.timeline.policy})
+        print('Timeline: ' + self.timeline.summary())
         self.sendProgress.emit(100)
         self.Spectrometer.probe_trigger = False
         print(time.strftime('%H:%M:%S') + ' Finished')
@@ -245,7 +397,15 @@ class KineticMeasurement(QtCore.QThread):
         self.sendParameter.emit('fast_shutter', 100)
         # acquire
         if not self.terminate:
-            self.spec = np.array(self.Spectrometer.get_intensities())
+            self.timeline.begin_step()
+            try:
+                self.spec = np.asarray(self.Spectrometer.get_intensities(), dtype=self.Spectrometer.dtype)
+            except TimeoutError as e:
+                print(time.strftime('%H:%M:%S') + ' ' + str(e))
+                self.timeline.fail_step()
+                self.sendParameter.emit('fast_shutter', 0)
+                return
+            self.timeline.end_step()
             # close shutter
             self.sendParameter.emit('fast_shutter', 0)
             self.sendSpectrum.emit(self.wls, self.spec)
@@ -0,0 +1,88 @@
+"""
+Pipelined acquisition. Reading a spectrum blocks for the integration time, while converting and sending it only needs
+the CPU. An AcquisitionPipeline calls get_intensities in its own thread into the free slots of a FramePool, such that
+the next spectrum is integrated while the measurement thread sends the previous one. The number of slots bounds how
+far acquisition runs ahead, it stalls once all slots wait to be processed.
+
+The duty cycle is the fraction of the wall time spent in get_intensities, i.e. waiting for the detector. Close to 1,
+the detector is never idle because of downstream work.
+"""
+import time
+import queue
+import threading
+
+
+class AcquisitionPipeline:
+    """ Acquires spectra of spectrometer into the slots of pool. get() returns the index of the next filled slot,
+    which has to be given back with pool.release() once it is processed."""
+
+    def __init__(self, spectrometer, pool, fill_in_place=False):
+        self.spectrometer = spectrometer
+        self.pool = pool
+        self.fill_in_place = fill_in_place  # driver accepts get_intensities(out=slot)
+        self.ready = queue.Queue()
+        self.running = False
+        self.thread = None
+        self.start_ns = 0
+        self.integration_ns = 0  # time spent in get_intensities
+        self.n_frames = 0
+        self.n_stalls = 0  # times no slot was free within the timeout
+        self.error = None
+
+    def start(self):
+        self.running = True
+        self.start_ns = time.perf_counter_ns()
+        self.integration_ns = 0
+        self.n_frames = 0
+        self.n_stalls = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.acquire_loop, daemon=True)
+        self.thread.start()
+
+    def acquire_loop(self):
+        while self.running:
+            idx = self.pool.acquire(timeout=0.1)
+            if idx is None:
+                self.n_stalls = self.n_stalls + 1
+                continue
+            slot = self.pool.slot(idx)
+            t1 = time.perf_counter_ns()
+            try:
+                if self.fill_in_place:
+                    self.spectrometer.get_intensities(out=slot)
+                else:
+                    slot[:] = self.spectrometer.get_intensities()
+            except TimeoutError as e:  # e.g. settings changed, try again
+                self.pool.release(idx)
+                print(time.strftime('%H:%M:%S') + ' ' + str(e))
+                continue
+            except Exception as e:
+                self.pool.release(idx)
+                self.error = e
+                print(time.strftime('%H:%M:%S') + ' Acquisition failed: ' + str(e))
+                self.running = False
+                break
+            self.integration_ns = self.integration_ns + time.perf_counter_ns() - t1
+            self.n_frames = self.n_frames + 1
+            self.ready.put(idx)
+
+    def get(self, timeout=None):
+        """ Index of the next acquired slot, or None if there is none within timeout seconds."""
+        try:
+            return self.ready.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def is_running(self):
+        return self.running or not self.ready.empty()
+
+    def stop(self):
+        """ Ends acquisition after the spectrum in flight. Slots acquired before can still be read with get()."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def duty_cycle(self):
+        elapsed = time.perf_counter_ns() - self.start_ns
+        return self.integration_ns / elapsed if elapsed > 0 else 0.
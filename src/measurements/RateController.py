@@ -0,0 +1,112 @@
+"""
+Acquisition rate control. Instead of a fixed pause after every spectrum, measurements call pace() once per spectrum.
+Acquisition runs unthrottled as long as the consumers keep up. When the backlog, the number of spectra waiting to be
+received by DataHandling or in its writer queue, rises above high_backlog, the target rate is lowered below the
+achieved rate, again in every control interval in which the backlog still grows. The rate is held while the backlog
+stays constant or drains, raised step by step while it stays below low_backlog, and the throttle is removed once the
+target is well above what the detector delivers anyway.
+
+The controller is registered like a device, such that max_rate can be set and target_rate and achieved_rate are shown
+in the parameter tree and stored with the other parameters. A rate of 0 means unlimited.
+"""
+import time
+from collections import defaultdict
+
+
+class RateController:
+
+    name = 'Acquisition'
+
+    def __init__(self, max_rate=0., min_rate=1., high_backlog=200, low_backlog=20, control_interval=0.25):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.high_backlog = high_backlog
+        self.low_backlog = low_backlog
+        self.control_interval = control_interval
+        self.decrease = 0.7  # factor of the target rate when the consumers fall behind
+        self.increase = 1.2  # factor per control interval while they keep up
+        self.backlog = None  # callable(n_sent) returning the number of spectra waiting in DataHandling, set in main
+        self.target_rate = 0.  # 0: not throttled
+        self.achieved_rate = 0.
+        self.n_sent = 0
+        self.last_backlog = 0
+        self.next_time = 0.
+        self.window_start = 0.
+        self.window_sent = 0
+
+        # set parameter dict
+        self.parameter_display_dict = defaultdict(dict)
+        self.parameter_display_dict['max_rate']['val'] = max_rate
+        self.parameter_display_dict['max_rate']['unit'] = ' Hz'
+        self.parameter_display_dict['max_rate']['max'] = 100000
+        self.parameter_display_dict['max_rate']['read'] = False
+        self.parameter_display_dict['target_rate']['val'] = 0
+        self.parameter_display_dict['target_rate']['unit'] = ' Hz'
+        self.parameter_display_dict['target_rate']['max'] = 100000
+        self.parameter_display_dict['target_rate']['read'] = True
+        self.parameter_display_dict['achieved_rate']['val'] = 0
+        self.parameter_display_dict['achieved_rate']['unit'] = ' Hz'
+        self.parameter_display_dict['achieved_rate']['max'] = 100000
+        self.parameter_display_dict['achieved_rate']['read'] = True
+
+        # set up parameter dict that only contains value. (faster to access)
+        self.parameter_dict = {}
+        for key in self.parameter_display_dict.keys():
+            self.parameter_dict[key] = self.parameter_display_dict[key]['val']
+
+    def set_parameter(self, parameter, value):
+        if parameter == 'max_rate':
+            self.parameter_dict['max_rate'] = value
+            self.max_rate = value
+
+    def start(self):
+        # called by a measurement before its first spectrum
+        self.target_rate = 0.
+        self.achieved_rate = 0.
+        self.n_sent = 0
+        self.last_backlog = 0
+        self.next_time = time.perf_counter()
+        self.window_start = self.next_time
+        self.window_sent = 0
+
+    def rate(self):
+        """ Rate the spectra are currently limited to, 0 if unlimited."""
+        rates = [rate for rate in (self.target_rate, self.max_rate) if rate > 0]
+        return min(rates) if rates else 0.
+
+    def pace(self):
+        """ Called after each sent spectrum. Adapts the target rate once per control interval and waits as long as
+        needed to keep to it."""
+        self.n_sent = self.n_sent + 1
+        now = time.perf_counter()
+        if now - self.window_start >= self.control_interval:
+            self.achieved_rate = (self.n_sent - self.window_sent) / (now - self.window_start)
+            self.window_start = now
+            self.window_sent = self.n_sent
+            self.control()
+        rate = self.rate()
+        if rate > 0:
+            wait = self.next_time - now
+            if wait > 0:
+                time.sleep(wait)
+            self.next_time = max(self.next_time, now) + 1. / rate
+
+    def control(self):
+        backlog = self.backlog(self.n_sent) if self.backlog is not None else 0
+        if backlog > self.high_backlog and backlog > self.last_backlog:
+            current = self.target_rate if self.target_rate > 0 else self.achieved_rate
+            self.target_rate = max(self.min_rate, min(current, self.achieved_rate) * self.decrease)
+        elif backlog < self.low_backlog and self.target_rate > 0:
+            self.target_rate = self.target_rate * self.increase
+            if self.target_rate > 1.5 * self.achieved_rate:  # limited by the detector, not by the throttle
+                self.target_rate = 0.
+        self.last_backlog = backlog
+        self.parameter_dict['target_rate'] = self.rate()
+        self.parameter_dict['achieved_rate'] = self.achieved_rate
+
+    def stop(self):
+        # called by a measurement when it has finished
+        self.achieved_rate = 0.
+        self.target_rate = 0.
+        self.parameter_dict['target_rate'] = self.rate()
+        self.parameter_dict['achieved_rate'] = 0.
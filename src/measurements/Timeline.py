@@ -0,0 +1,111 @@
+"""
+Scheduler for measurements that follow a timeline, e.g. the steps of a KineticMeasurement. Times are taken from
+time.perf_counter_ns. Waiting sleeps until spin_time before the target and spins for the rest, which gives
+sub-millisecond accuracy without keeping a core busy for long waits. Steps that are reached more than late_tolerance
+after their time are handled according to the policy:
+- 'catch_up': the step is executed at once, the following steps keep their times.
+- 'skip': the step is not executed.
+- 'shift': the step is executed at once and the rest of the timeline is delayed by its lateness.
+Each step is recorded with its nominal, scheduled and actual times, such that the real acquisition times can be stored
+with the data.
+"""
+import time
+import numpy as np
+
+ON_TIME, LATE, SKIPPED = 0, 1, 2
+
+
+class TimelineScheduler:
+    """ Timeline starting at start(). wait_until(t) blocks until t seconds after the start (plus the shift of the
+    'shift' policy) and returns False if the step is to be skipped. begin_step/end_step record the actual times."""
+
+    columns = ['step', 'nominal', 'scheduled', 'start', 'end', 'lateness', 'status']
+    policies = ('catch_up', 'skip', 'shift')
+
+    def __init__(self, policy='catch_up', late_tolerance=0.001, spin_time=0.002):
+        if policy not in self.policies:
+            print('Unknown late policy ' + str(policy) + ', using catch_up')
+            policy = 'catch_up'
+        self.policy = policy
+        self.late_tolerance_ns = int(late_tolerance * 1e9)
+        self.spin_time_ns = int(spin_time * 1e9)
+        self.t0_ns = 0
+        self.t0_absolute = 0.  # time.time() at the start, to relate the timeline to absolute times
+        self.shift_ns = 0
+        self.records = []
+        self.current = None  # record of the running step
+
+    def start(self):
+        self.t0_absolute = time.time()
+        self.t0_ns = time.perf_counter_ns()
+        self.shift_ns = 0
+        self.records = []
+
+    def elapsed(self):
+        """ Seconds since the start."""
+        return (time.perf_counter_ns() - self.t0_ns) / 1e9
+
+    def wait_until(self, nominal):
+        """ Waits until the step at nominal seconds is due. Returns False if the step is late and skipped."""
+        target = self.t0_ns + self.shift_ns + int(nominal * 1e9)
+        now = time.perf_counter_ns()
+        status = ON_TIME
+        if now - target > self.late_tolerance_ns:
+            status = LATE
+            if self.policy == 'skip':
+                self.current = [len(self.records), nominal, target, now, now, now - target, SKIPPED]
+                self.end_step()
+                return False
+            if self.policy == 'shift':  # the late step keeps its lateness, the following steps are moved
+                self.shift_ns = self.shift_ns + now - target
+        else:
+            remaining = target - now
+            if remaining > self.spin_time_ns:
+                time.sleep((remaining - self.spin_time_ns) / 1e9)
+            while time.perf_counter_ns() < target:
+                pass
+        self.current = [len(self.records), nominal, target, 0, 0, 0, status]
+        return True
+
+    def begin_step(self):
+        # called right before the acquisition of the step
+        now = time.perf_counter_ns()
+        self.current[3] = now
+        self.current[5] = now - self.current[2]
+
+    def end_step(self):
+        # called when the spectrum of the step is received
+        if self.current[4] == 0:
+            self.current[4] = time.perf_counter_ns()
+        self.records.append(self.current)
+        self.current = None
+
+    def fail_step(self):
+        # called if the acquisition of the step failed or was not started, the step is recorded as skipped
+        if self.current[3] == 0:  # not started, recorded like a step skipped by wait_until
+            now = time.perf_counter_ns()
+            self.current[3:6] = [now, now, now - self.current[2]]
+        self.current[6] = SKIPPED
+        self.end_step()
+
+    def timeline(self):
+        """ Returns the recorded steps as (n_steps x 7) array with the columns of TimelineScheduler.columns. Times are
+        in seconds since the start."""
+        if not self.records:
+            return np.zeros([0, len(self.columns)])
+        table = np.array(self.records, dtype=np.float64)
+        table[:, 2:5] = (table[:, 2:5] - self.t0_ns) / 1e9
+        table[:, 5] = table[:, 5] / 1e9
+        return table
+
+    def summary(self):
+        """ Short text with number of late and skipped steps, mean and maximum lateness."""
+        table = self.timeline()
+        if len(table) == 0:
+            return 'no steps'
+        executed = table[table[:, 6] != SKIPPED]
+        lateness = executed[:, 5] if len(executed) else np.zeros(1)
+        return (str(len(table)) + ' steps, ' + str(int(np.sum(table[:, 6] == LATE))) + ' late, ' +
+                str(int(np.sum(table[:, 6] == SKIPPED))) + ' skipped, lateness mean ' +
+                '{:.3f}'.format(np.mean(lateness) * 1000) + ' ms, max ' + '{:.3f}'.format(np.max(lateness) * 1000) +
+                ' ms')